@@ -1,18 +1,29 @@
-from fastapi import FastAPI, WebSocket, Request, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, WebSocket, Request, Response, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 import uvicorn
-import scripts.gemini as gemini
 import scripts.searchv2 as searchv2
-from google.genai import types
+from scripts.embedding_engine import engine as embedding_engine
+from scripts.semantic_cache import SemanticCache
+from scripts.conversation import Conversation, CONVERSATION_KEEP_TURNS, CONVERSATION_TOKEN_BUDGET
 import scripts.chat_history as chat_history
+from scripts.history_writer import writer as history_writer
+from scripts.response_cache import first_turn_cache, FIRST_TURN_CACHE
+import scripts.cache as cache
+import scripts.hot_queries as hot_queries
+import scripts.metrics as metrics
 from pydantic import BaseModel
 import redis
 import json
 import asyncio
+import hashlib
+import os
 import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
 from pinecone import QueryResponse
 from bson import ObjectId
 from datetime import datetime
@@ -21,13 +32,54 @@ class SearchRequest(BaseModel):
     search_query: str
     top_k: int = 5
 
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-if redis_client.ping():
-    print("Connected to Redis!")
 CACHE_EXPIRATION = 3600
 
+semantic_cache = SemanticCache(
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+    max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "2048")),
+)
+# Which stage answered each search: "cache", "quote", "lexical", "semantic_cache" or "live" (+"lexical" when fused),
+# plus "coalesced" for requests that waited on an identical in-flight lookup
+search_sources = Counter()
+
+# Single-flight: concurrent misses for the same (query, top_k) share one lookup task
+inflight_searches: Dict[Tuple[str, int], asyncio.Task] = {}
+# Optionally also coalesce across worker processes with a short Redis lock
+SEARCH_LOCK_REDIS = os.getenv("SEARCH_LOCK_REDIS", "0") == "1"
+SEARCH_LOCK_TIMEOUT = float(os.getenv("SEARCH_LOCK_TIMEOUT", "5"))
+SEARCH_LOCK_POLL = 0.05
+RELEASE_LOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "0") == "1"
+
+# Search cache warmup from hot queries; "/" reports unhealthy until the startup run finishes
+CACHE_WARMUP = os.getenv("CACHE_WARMUP", "0") == "1"
+CACHE_WARMUP_CONCURRENCY = int(os.getenv("CACHE_WARMUP_CONCURRENCY", "8"))
+warmup_state = {"done": not CACHE_WARMUP, "queries": 0, "covered": 0, "seconds": 0.0}
+warmup_task: Optional[asyncio.Task] = None
+# Fire-and-forget work started outside a request (e.g. from the websocket), referenced until done
+background_jobs: Set[asyncio.Task] = set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if await cache.ping():
+        print("Connected to Redis!")
+    if EMBEDDING_WARMUP:
+        await asyncio.to_thread(embedding_engine.warmup)
+    await asyncio.to_thread(chat_history.ensure_indexes)
+    history_writer.start()
+    start_warmup()
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await history_writer.close()
+    await searchv2.hf_client.aclose()
+    await cache.close()
+
+
 limiter = Limiter(key_func=get_remote_address)
-app = FastAPI(title="Movie Character API")
+app = FastAPI(title="Movie Character API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -46,9 +98,50 @@ active_connections: List[WebSocket] = []
 
 
 @app.get("/")
-async def health_check():
+async def health_check(response: Response):
+    if not warmup_state["done"]:
+        response.status_code = 503
+        return {"status": "warming", "timestamp": time.time()}
     return {"status": "healthy", "timestamp": time.time()}
 
+@app.get("/stats")
+async def stats():
+    """Runtime statistics for tuning the in-process components."""
+    return {
+        "embedding_engine": embedding_engine.stats(),
+        "embedding_cache": searchv2.embedding_cache.stats(),
+        "hf_client": searchv2.hf_client.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "response_cache": cache.stats(),
+        "search_sources": dict(search_sources),
+        "warmup": warmup_state,
+        "first_turn_cache": first_turn_cache.stats(),
+        "chat_history": history_writer.stats(),
+    }
+
+def cache_counters() -> dict:
+    """Hit and miss counts of every cache layer, and which stage served each search."""
+    lookups = []
+    for namespace, namespace_stats in cache.stats().items():
+        lookups.append(({"cache": namespace, "result": "hit"}, namespace_stats["hits"]))
+        lookups.append(({"cache": namespace, "result": "miss"}, namespace_stats["misses"]))
+    embedding_stats = searchv2.embedding_cache.stats()
+    lookups.append(({"cache": "embedding", "result": "hit"}, embedding_stats["hits"]))
+    lookups.append(({"cache": "embedding", "result": "redis_hit"}, embedding_stats["redis_hits"]))
+    lookups.append(({"cache": "embedding", "result": "miss"}, embedding_stats["misses"]))
+    for name, layer_stats in (("semantic", semantic_cache.stats()), ("first_turn", first_turn_cache.stats())):
+        lookups.append(({"cache": name, "result": "hit"}, layer_stats["hits"]))
+        lookups.append(({"cache": name, "result": "miss"}, layer_stats["misses"]))
+    return {
+        "cache_lookups_total": lookups,
+        "search_source_total": [({"source": source}, count) for source, count in sorted(search_sources.items())],
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Stage latency histograms and cache counters in the Prometheus text format."""
+    return Response(content=metrics.render(cache_counters()), media_type="text/plain; version=0.0.4")
+
 def serialize_mongo_document(document):
     """Recursively convert ObjectId and datetime fields in MongoDB documents to JSON serializable formats."""
     if isinstance(document, list):
@@ -71,175 +164,412 @@ def convert_doc(doc):
     return doc
 
 
-def get_cached_context(query: str) -> Optional[dict]:
-    cache_key = f"search_context:{query}"
-    cached_data = redis_client.get(cache_key)
-    if cached_data:
-        return json.loads(cached_data)
-    return None
+def to_serializable(result) -> dict:
+    """Convert a Pinecone query response into a JSON serializable dict."""
+    if hasattr(result, "to_dict"):
+        result = result.to_dict()
+    elif isinstance(result, QueryResponse):
+        result = json.loads(json.dumps(result, default=lambda o: o.__dict__))
+    return json.loads(json.dumps(result, default=str))
 
-def cache_context(query: str, result) -> None:
+
+async def get_cached_context(query: str, top_k: int) -> Tuple[Optional[dict], str]:
+    """Cached search result (None on a miss) and the key to cache a fresh result under."""
+    with metrics.timer("redis"):
+        return await cache.get_tagged_json("search_context", f"{top_k}:{query}")
+
+async def cache_context(query: str, top_k: int, result, cache_key: Optional[str] = None) -> None:
     """
     Caches the search result in Redis for future use.
 
     :param query: The search query used to fetch results.
+    :param top_k: Number of matches the result was fetched with.
     :param result: The search result (may need conversion).
+    :param cache_key: Key returned by the lookup that missed; skips re-reading the tag versions.
     """
-    cache_key = f"search_context:{query}"
-    
     try:
-
-        if hasattr(result, "to_dict"):
-            result = result.to_dict()
-        elif isinstance(result, QueryResponse):
-            result = json.loads(json.dumps(result, default=lambda o: o.__dict__))
-
-        json_result = json.dumps(result, ensure_ascii=False)
-
-        redis_client.setex(cache_key, CACHE_EXPIRATION, json_result)
+        with metrics.timer("redis"):
+            if cache_key is None:
+                cache_key = await cache.tagged_key("search_context", f"{top_k}:{query}")
+            await cache.set_json(cache_key, to_serializable(result), CACHE_EXPIRATION)
 
     except TypeError as e:
         print(f"ERROR: Failed to serialize result to JSON: {e}")
     except redis.RedisError as e:
         print(f"ERROR: Redis error occurred: {e}")
 
+async def resolve_search(query: str, top_k: int) -> Tuple[Optional[dict], str]:
+    """The stages behind the exact cache: quote index, exact lexical match, semantic cache, live lookup."""
+    # Known movie lines resolve in-process from the quote index
+    with metrics.timer("quote_index"):
+        result = searchv2.quote_query(query, top_k)
+    if result is not None:
+        search_sources["quote"] += 1
+        return result, "quote"
+
+    # In-process BM25 first stage: an exact quote needs no embedding or index call
+    with metrics.timer("lexical"):
+        # Scoring touches every posting of the query terms, so it stays off the event loop
+        lexical_result = await asyncio.to_thread(searchv2.lexical_query, query, top_k)
+        result = searchv2.exact_lexical_match(query, lexical_result, top_k)
+    source = "lexical"
+    if result is None:
+        with metrics.timer("embed"):
+            vector = await searchv2.aembed_query(query)
+        with metrics.timer("semantic_cache"):
+            result = semantic_cache.lookup(vector, top_k)
+        source = "semantic_cache"
+        if result is None:
+            with metrics.timer("vector_search"):
+                response = await asyncio.to_thread(searchv2.query_index, vector, top_k)
+            source = "live"
+            result = to_serializable(response) if response is not None else {"matches": []}
+            if result.get("matches"):
+                semantic_cache.add(query, vector, result, top_k)
+        if lexical_result and lexical_result["matches"]:
+            result = searchv2.fuse_results(result, lexical_result, top_k)
+            source += "+lexical"
+    search_sources[source] += 1
+    return (result if result.get("matches") else None), source
+
+async def resolve_search_locked(query: str, top_k: int) -> Tuple[Optional[dict], str, bool]:
+    """
+    `resolve_search` under a short Redis lock, so one worker resolves a query while
+    the others wait for its cached result. Returns whether the result is already cached.
+    """
+    lock_key = f"search_lock:{top_k}:{hashlib.sha1(query.encode('utf-8')).hexdigest()}"
+    token = uuid.uuid4().hex
+    cache_key = None
+    try:
+        held = bool(await cache.client.set(lock_key, token, nx=True, px=int(SEARCH_LOCK_TIMEOUT * 1000)))
+        if not held:
+            cache_key = await cache.tagged_key("search_context", f"{top_k}:{query}")
+            deadline = time.monotonic() + SEARCH_LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(SEARCH_LOCK_POLL)
+                cached_result = await cache.get_json(cache_key)
+                if cached_result:
+                    search_sources["coalesced_across_workers"] += 1
+                    return cached_result, "cache", True
+                if not await cache.client.exists(lock_key):
+                    break
+    except redis.RedisError as e:
+        print(f"ERROR: Search lock unavailable, resolving locally: {e}")
+        held = False
+
+    try:
+        result, source = await resolve_search(query, top_k)
+        if result is not None:
+            await cache_context(query, top_k, result, cache_key)
+        return result, source, True
+    finally:
+        if held:
+            try:
+                # Only release the lock if it is still ours
+                await cache.client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except redis.RedisError as e:
+                print(f"ERROR: Could not release search lock: {e}")
+
+async def resolve_search_unlocked(query: str, top_k: int) -> Tuple[Optional[dict], str, bool]:
+    result, source = await resolve_search(query, top_k)
+    return result, source, False
+
+def _forget_search(key: Tuple[str, int], task: asyncio.Task) -> None:
+    inflight_searches.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # retrieved here so a failure nobody awaited is not logged as unhandled
+
+async def search_context(query: str, top_k: int = 1,
+                         background_tasks: Optional[BackgroundTasks] = None) -> Tuple[Optional[dict], str]:
+    """
+    Resolve a query through the exact cache, the quote index, an exact lexical match,
+    the semantic cache, then a live lookup; vector results are fused with the lexical
+    candidates. Concurrent misses for the same query share one lookup.
+
+    Returns the search result (None if nothing was found) and the stage that served
+    it: "cache", "quote", "lexical", "semantic_cache" or "live", with "+lexical" when fused.
+    """
+    cached_result, cache_key = await get_cached_context(query, top_k)
+    if cached_result:
+        search_sources["cache"] += 1
+        return cached_result, "cache"
+
+    key = (query, top_k)
+    task = inflight_searches.get(key)
+    if task is not None:
+        search_sources["coalesced"] += 1
+        result, source, _ = await asyncio.shield(task)
+        return result, source
+
+    resolve = resolve_search_locked if SEARCH_LOCK_REDIS else resolve_search_unlocked
+    task = asyncio.create_task(resolve(query, top_k))
+    inflight_searches[key] = task
+    task.add_done_callback(lambda done: _forget_search(key, done))
+    # Shielded so a disconnecting client does not cancel the lookup other requests wait on
+    result, source, cached = await asyncio.shield(task)
+
+    if result is not None and not cached:
+        if background_tasks is not None:
+            background_tasks.add_task(cache_context, query, top_k, result, cache_key)
+        else:
+            await cache_context(query, top_k, result, cache_key)
+    return result, source
+
+async def warm_search_cache(top_k: int = 1) -> None:
+    """
+    Resolve the hot queries that are not cached yet through `search_context`, at most
+    CACHE_WARMUP_CONCURRENCY at a time. Embeddings take the same path as live traffic
+    (HF endpoint first, local engine as fallback).
+    """
+    start = time.perf_counter()
+    queries = await hot_queries.load()
+    # One MGET for every hot query instead of a round trip each
+    keys = await cache.tagged_keys("search_context", [f"{top_k}:{query}" for query in queries])
+    cached = await cache.get_many_json(keys)
+    pending = [query for query, result in zip(queries, cached) if not result]
+
+    semaphore = asyncio.Semaphore(CACHE_WARMUP_CONCURRENCY)
+
+    async def warm(query: str) -> bool:
+        async with semaphore:
+            try:
+                result, _ = await search_context(query, top_k)
+                return result is not None
+            except Exception as e:
+                print(f"ERROR: Warmup failed for {query!r}: {e}")
+                return False
+
+    resolved = await asyncio.gather(*(warm(query) for query in pending))
+    covered = len(queries) - len(pending) + sum(resolved)
+    seconds = time.perf_counter() - start
+    warmup_state.update(queries=len(queries), covered=covered, seconds=round(seconds, 2))
+    print(f"Cache warmup: {covered}/{len(queries)} hot queries cached "
+          f"({len(queries) - len(pending)} already cached) in {seconds:.1f} s")
+
+async def run_warmup() -> None:
+    try:
+        await warm_search_cache()
+    except Exception as e:
+        print(f"ERROR: Cache warmup failed: {e}")
+    finally:
+        warmup_state["done"] = True
+
+def run_in_background(coro) -> asyncio.Task:
+    """Run `coro` without awaiting it, keeping a reference so the task is not garbage collected."""
+    task = asyncio.create_task(coro)
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+    return task
+
+def start_warmup() -> None:
+    """Warm the search cache in the background so the server keeps accepting connections."""
+    global warmup_task
+    if CACHE_WARMUP and (warmup_task is None or warmup_task.done()):
+        warmup_task = asyncio.create_task(run_warmup())
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    
-    chat = gemini.client.chats.create(
-        model="gemini-2.0-flash",
-        config=types.GenerateContentConfig(system_instruction=sys_inst)
-    )
+
+    # ?stream=1 forwards the reply as JSON token frames followed by an end frame
+    stream = websocket.query_params.get("stream") == "1"
+    conversation = Conversation(sys_inst, keep_turns=CONVERSATION_KEEP_TURNS, token_budget=CONVERSATION_TOKEN_BUDGET)
     active_connections.append(websocket)
 
     await websocket.send_text("Enter username: ")
     username = await websocket.receive_text()
-    chat_window_id = chat_history.create_chat_window(username)
+    chat_window_id = history_writer.create_chat_window(username)
     movie_title = ""
     context = ""
-    message = ""
-    gem_response = None
+    context_id = ""
     await websocket.send_text("Enter any movie dialogue")
     try:
         while True:
             query = await websocket.receive_text()
             print(f"Client: {query}")
+            timings = metrics.start_timings()
             try:
                 if not movie_title or not context:
-                    cached_result = get_cached_context(query)
-                    
-                    if cached_result:
-                        search_result = cached_result
-                    else:
-                        search_result = await asyncio.to_thread(searchv2.get_context, query)
-                        if search_result["matches"]:
-                            cache_context(query, search_result)
-                    
-                    if search_result["matches"]:
+                    with metrics.timer("search"):
+                        search_result, _ = await search_context(query)
+                    run_in_background(hot_queries.record(query))
+
+                    if search_result and search_result["matches"]:
                         context = search_result["matches"][0]["metadata"]["text"]
                         movie_title = search_result["matches"][0]["metadata"]["movie_title"]
+                        context_id = search_result["matches"][0].get("id", "")
+                        # The context goes into the system instruction once, not into every message
+                        conversation.set_context(movie_title, context)
                 if movie_title:
                     await websocket.send_text(f"movie: {movie_title}")
-                message = f"""
-                            movie title: {movie_title}
-                            context: {context}
-                            user message: {query}
-                            """
-                gem_response = await asyncio.to_thread(gemini.send_message, message, chat)
+                # Opening exchanges for the same retrieved chunk can reuse a pooled reply
+                first_turn = FIRST_TURN_CACHE and bool(context_id) and conversation.turn_count == 0
+                cached_reply = None
+                if first_turn:
+                    with metrics.timer("redis"):
+                        cached_reply = await first_turn_cache.get(movie_title, context_id, query)
+                start = time.perf_counter()
+                if cached_reply is not None:
+                    reply = cached_reply
+                    conversation.add_turn(query, reply)
+                    if stream:
+                        await websocket.send_text(json.dumps({"type": "token", "text": reply}))
+                        total_ms = round((time.perf_counter() - start) * 1000, 1)
+                        await websocket.send_text(json.dumps({
+                            "type": "end", "time_to_first_token_ms": total_ms, "total_ms": total_ms, "cached": True,
+                            "stages": timings.as_dict(),
+                        }))
+                    else:
+                        await websocket.send_text(reply)
+                    print("Gemini: first-turn reply served from cache")
+                elif stream:
+                    parts = []
+                    first_token_ms = None
+                    async for text in conversation.stream(query):
+                        if first_token_ms is None:
+                            first_token_ms = (time.perf_counter() - start) * 1000
+                        parts.append(text)
+                        await websocket.send_text(json.dumps({"type": "token", "text": text}))
+                    reply = "".join(parts)
+                    total_ms = (time.perf_counter() - start) * 1000
+                    await websocket.send_text(json.dumps({
+                        "type": "end",
+                        "time_to_first_token_ms": round(first_token_ms or total_ms, 1),
+                        "total_ms": round(total_ms, 1),
+                        "stages": timings.as_dict(),
+                    }))
+                    print(f"Gemini: first token {first_token_ms or total_ms:.0f} ms, total {total_ms:.0f} ms")
+                else:
+                    reply = await conversation.send(query)
+                    print(f"Gemini: total {(time.perf_counter() - start) * 1000:.0f} ms")
+                    await websocket.send_text(reply)
+                if first_turn and cached_reply is None:
+                    with metrics.timer("redis"):
+                        await first_turn_cache.add(movie_title, context_id, query, reply)
             except Exception as err:
                 await websocket.send_text(f"Error: {str(err)}")
+                continue
 
-            chat_history.add_message(chat_window_id, message, gem_response.text)
-            await websocket.send_text(gem_response.text)
+            history_writer.add_message(chat_window_id, query, reply, movie_title)
+            # Summarizing older turns is a model call; it must not delay the next message
+            run_in_background(conversation.compact())
+            metrics.observe("turn", time.perf_counter() - timings.start)
+            print(f"Turn stages: {timings.summary()}")
     except Exception as e:
         print(f"Connection closed: {e}")
     finally:
         active_connections.remove(websocket)
+        await history_writer.flush(chat_window_id)
 
 @app.post("/search_dialogue")
-async def search_dialogue(request: SearchRequest, background_tasks: BackgroundTasks, request_obj: Request):
+async def search_dialogue(request: SearchRequest, background_tasks: BackgroundTasks, request_obj: Request,
+                          http_response: Response):
     if not request.search_query:
         raise HTTPException(status_code=400, detail="search_query is required")
 
-    cached_result = get_cached_context(request.search_query)
-    if cached_result:
-        return {"response": cached_result, "source": "cache"}
-
-    response = await asyncio.to_thread(searchv2.get_context, request.search_query, request.top_k)
-
-    if response is None:
-        return {"response": "No results found", "source": "live"}
-
+    timings = metrics.start_timings()
     try:
-        response_dict = json.loads(json.dumps(response, default=str))
-    except Exception as e:
+        with metrics.timer("search"):
+            response, source = await search_context(request.search_query, request.top_k, background_tasks)
+        background_tasks.add_task(hot_queries.record, request.search_query)
+    except (TypeError, ValueError) as e:
         raise HTTPException(status_code=500, detail=f"Serialization error: {str(e)}")
+    # Per-stage durations show up in the browser's network panel and in tracing proxies
+    http_response.headers["Server-Timing"] = timings.header()
 
-    background_tasks.add_task(cache_context, request.search_query, response_dict)
+    if response is None:
+        return {"response": "No results found", "source": source}
 
-    return {"response": response_dict, "source": "live"}
+    return {"response": response, "source": source}
 
 
 @app.get("/get_user_chats")
-async def get_user_chats_route(user_id: str):
-    cache_key = f"user_chats:{user_id}"
-
+async def get_user_chats_route(user_id: str, limit: int = 20, cursor: Optional[str] = None):
+    """Returns chat summaries, most recently active first; pass `next_cursor` back as `cursor` for more."""
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
     try:
-        cached_data = redis_client.get(cache_key)
+        with metrics.timer("redis"):
+            cached_data, cache_key = await cache.get_tagged_json(
+                "user_chats", f"{user_id}:{limit}:{cursor or ''}", [f"user:{user_id}"]
+            )
         if cached_data:
-            return json.loads(cached_data)
+            return cached_data
 
-        result = await asyncio.to_thread(chat_history.get_user_chats, user_id)
+        with metrics.timer("mongo"):
+            chats, next_cursor = await asyncio.to_thread(chat_history.get_user_chats, user_id, limit, cursor)
+        result = {"chats": [convert_doc(chat) for chat in chats], "next_cursor": next_cursor}
 
-        if result:
-            result = serialize_mongo_document(result)  # Ensure datetime conversion
-            redis_client.setex(cache_key, 300, json.dumps(result))
+        if chats:
+            await cache.set_json(cache_key, result, 300)
 
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.delete("/delete_chat")
 async def delete_chat_route(chat_id: str):
-    """Deletes a chat and clears related cache."""
+    """Deletes a chat and invalidates only the caches that referenced it."""
     try:
-        result = await asyncio.to_thread(chat_history.delete_chat, chat_id)
-
-        pattern = "user_chats:*"
-        for key in redis_client.scan_iter(pattern):
-            redis_client.delete(key)
-
-        return result
+        with metrics.timer("mongo"):
+            user_id = await asyncio.to_thread(chat_history.delete_chat, chat_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
 
+    try:
+        await cache.invalidate(f"user:{user_id}", f"chat:{chat_id}")
+    except redis.RedisError as e:
+        print(f"ERROR: Could not invalidate chat caches: {e}")
+
+    return {"status": "Chat deleted successfully"}
 
-@app.get("/get_chat_history")
-async def get_chat_history_route(chat_id: str):
-    cache_key = f"chat_history:{chat_id}"
 
+@app.get("/get_chat_history")
+async def get_chat_history_route(chat_id: str, limit: int = 50, cursor: Optional[str] = None):
+    """Returns the newest `limit` messages; pass `next_cursor` back as `cursor` for older ones."""
+    if not 1 <= limit <= 200:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 200")
     try:
-        cached_data = redis_client.get(cache_key)
+        with metrics.timer("redis"):
+            cached_data, cache_key = await cache.get_tagged_json(
+                "chat_history", f"{chat_id}:{limit}:{cursor or ''}", [f"chat:{chat_id}"]
+            )
         if cached_data:
-            return json.loads(cached_data)
-
-        result = await asyncio.to_thread(chat_history.get_chat_history, chat_id)
-
-        if result:
+            return cached_data
+
+        with metrics.timer("mongo"):
+            messages, next_cursor = await asyncio.to_thread(chat_history.get_chat_history, chat_id, limit, cursor)
+        if cursor is None:
+            # Messages still in the write-behind buffer are newer than anything in Mongo
+            messages = messages + history_writer.pending_messages(chat_id)
+            if len(messages) > limit:
+                messages = messages[-limit:]
+                next_cursor = chat_history.encode_cursor(messages[0])
+
+        result = {"messages": messages, "next_cursor": next_cursor}
+        if messages:
             result = serialize_mongo_document(result)  # Ensure datetime conversion
-            redis_client.setex(cache_key, 300, json.dumps(result))
+            await cache.set_json(cache_key, result, 300)
 
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/clear_cache")
 async def clear_cache():
-    """Clears the Redis cache."""
+    """Invalidates every cached response by bumping the global cache version."""
     try:
-        redis_client.flushdb()
+        await cache.invalidate(cache.GLOBAL_TAG)
+        semantic_cache.clear()
+        # Refill the hot queries; the instance stays healthy meanwhile
+        start_warmup()
         return {"status": "Cache cleared"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
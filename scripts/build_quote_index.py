@@ -0,0 +1,31 @@
+import json
+import os
+import sys
+
+from tqdm import tqdm
+from store_mongo import extract_dialogues_from_json
+from quote_index import QuoteIndex
+
+
+def iter_dialogues(folder_path):
+    """Yields `(movie_title, dialogues)` for every script, parsed exactly as store_mongo stores them."""
+    for filename in tqdm(sorted(f for f in os.listdir(folder_path) if f.endswith(".json")), desc="Parsing scripts"):
+        with open(os.path.join(folder_path, filename), "r", encoding="utf-8") as file:
+            try:
+                json_data = json.load(file)
+            except json.JSONDecodeError:
+                print(f"Error: Could not parse JSON in {filename}")
+                continue
+        yield extract_dialogues_from_json(json_data)
+
+
+def main(folder_path="../movie_scripts", index_path="../quote_index.npz"):
+    index = QuoteIndex.build(iter_dialogues(folder_path))
+    index.save(index_path)
+    print(f"Indexed {index.count} dialogue lines ({len(index.exact_hashes)} exact keys, "
+          f"{len(index.shingle_hashes)} shingles) into {index_path} "
+          f"({os.path.getsize(index_path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
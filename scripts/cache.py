@@ -0,0 +1,124 @@
+import json
+import os
+import time
+from collections import Counter
+from typing import Any, Iterable, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+
+# One pool per process, shared by every request; a second pool keeps raw bytes
+# (e.g. float16 vectors) away from the decoding client.
+pool = aioredis.ConnectionPool.from_url(REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+client = aioredis.Redis(connection_pool=pool)
+binary_pool = aioredis.ConnectionPool.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS)
+binary_client = aioredis.Redis(connection_pool=binary_pool)
+
+VERSION_PREFIX = "cache_version:"
+GLOBAL_TAG = "global"
+# Per-user and per-chat versions expire once every entry stamped with them has expired,
+# so they do not accumulate; keep this above the longest TTL of a user- or chat-tagged entry
+VERSION_TTL = int(os.getenv("CACHE_VERSION_TTL", "7200"))
+
+# Tagged lookups per key namespace, for hit-rate reporting
+_hits = Counter()
+_misses = Counter()
+
+# Reads the tag versions (KEYS), builds the `namespace:stamp:suffix` key (ARGV) the same
+# way as `tagged_key` and GETs it, so a tagged lookup is one round trip. The data key is
+# built server-side, so this assumes a standalone Redis rather than a cluster.
+_TAGGED_GET = client.register_script("""
+local stamp = {}
+for i, key in ipairs(KEYS) do stamp[i] = redis.call('GET', key) or '0' end
+local key = ARGV[1] .. ':' .. table.concat(stamp, '.') .. ':' .. ARGV[2]
+return {key, redis.call('GET', key) or false}
+""")
+
+
+async def ping() -> bool:
+    return await client.ping()
+
+
+async def close() -> None:
+    await client.aclose()
+    await binary_client.aclose()
+    await pool.disconnect()
+    await binary_pool.disconnect()
+
+
+async def get_json(key: str) -> Optional[Any]:
+    data = await client.get(key)
+    return json.loads(data) if data else None
+
+
+async def set_json(key: str, value: Any, ttl: int) -> None:
+    await client.setex(key, ttl, json.dumps(value, ensure_ascii=False))
+
+
+async def get_many_json(keys: List[str]) -> List[Optional[Any]]:
+    """Fetch several JSON values in a single round trip."""
+    if not keys:
+        return []
+    return [json.loads(data) if data else None for data in await client.mget(keys)]
+
+
+async def tagged_key(namespace: str, suffix: str, tags: Iterable[str] = ()) -> str:
+    """
+    Key for `namespace:suffix` stamped with the current versions of `tags` and the global tag.
+
+    Bumping any of those versions with `invalidate` makes every key built from the
+    old version unreachable in O(1); the stale entries then expire through their TTL.
+    A missing (never bumped or expired) version reads as "0".
+    """
+    tags = [GLOBAL_TAG, *tags]
+    versions = await client.mget([VERSION_PREFIX + tag for tag in tags])
+    stamp = ".".join(version or "0" for version in versions)
+    return f"{namespace}:{stamp}:{suffix}"
+
+
+async def tagged_keys(namespace: str, suffixes: List[str], tags: Iterable[str] = ()) -> List[str]:
+    """`tagged_key` for several suffixes sharing the same tags, reading the versions once."""
+    if not suffixes:
+        return []
+    key = await tagged_key(namespace, "", tags)
+    return [key + suffix for suffix in suffixes]
+
+
+async def get_tagged_json(namespace: str, suffix: str, tags: Iterable[str] = ()) -> Tuple[Optional[Any], str]:
+    """
+    Look up a tagged entry in one round trip; returns the value (None on a miss) and
+    the key to store it under, so filling a miss is a single SETEX.
+    """
+    keys = [VERSION_PREFIX + tag for tag in (GLOBAL_TAG, *tags)]
+    reply = await _TAGGED_GET(keys=keys, args=[namespace, suffix])
+    key, data = reply[0], (reply[1] if len(reply) > 1 else None)
+    value = json.loads(data) if data else None
+    (_hits if value is not None else _misses)[namespace] += 1
+    return value, key
+
+
+async def invalidate(*tags: str) -> None:
+    """Invalidate every entry tagged with any of `tags`, e.g. "user:<id>", "chat:<id>" or GLOBAL_TAG."""
+    if not tags:
+        return
+    # A fresh timestamp rather than INCR: a counter restarting at 0 after its key expired
+    # could climb back to a version that recently-written entries are still stamped with
+    version = time.time_ns()
+    async with client.pipeline(transaction=False) as pipe:
+        for tag in tags:
+            # The single global version never expires, it also stamps long-lived entries
+            pipe.set(VERSION_PREFIX + tag, version, ex=None if tag == GLOBAL_TAG else VERSION_TTL)
+        await pipe.execute()
+
+
+def stats() -> dict:
+    return {
+        namespace: {
+            "hits": _hits[namespace],
+            "misses": _misses[namespace],
+            "hit_rate": round(_hits[namespace] / max(_hits[namespace] + _misses[namespace], 1), 3),
+        }
+        for namespace in sorted(set(_hits) | set(_misses))
+    }
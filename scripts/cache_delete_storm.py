@@ -0,0 +1,65 @@
+import random
+import sys
+
+import httpx
+from chat_history import add_message, create_chat_window
+
+API_URL = "http://127.0.0.1:8000"
+USERS = 200
+CHATS_PER_USER = 5
+DELETES = 100
+READS_PER_USER = 3
+
+
+def namespace_counts(http, namespace):
+    counts = http.get("/stats").json()["response_cache"].get(namespace, {})
+    return counts.get("hits", 0), counts.get("misses", 0)
+
+
+def read_phase(http, users):
+    """Reads every user's chat list READS_PER_USER times; returns the hit rate of the phase."""
+    hits_before, misses_before = namespace_counts(http, "user_chats")
+    for _ in range(READS_PER_USER):
+        for user_id in users:
+            http.get("/get_user_chats", params={"user_id": user_id}).raise_for_status()
+    hits, misses = namespace_counts(http, "user_chats")
+    hits, misses = hits - hits_before, misses - misses_before
+    return hits / max(hits + misses, 1)
+
+
+def main(api_url=API_URL):
+    """Measures the chat-list cache hit rate before and after a storm of chat deletions."""
+    users = [f"storm_user_{i}" for i in range(USERS)]
+    chats = {user_id: [] for user_id in users}
+    print(f"Seeding {USERS * CHATS_PER_USER} chats for {USERS} users...")
+    for user_id in users:
+        for _ in range(CHATS_PER_USER):
+            chat_id = create_chat_window(user_id)
+            add_message(chat_id, "storm message", "storm response")
+            chats[user_id].append(chat_id)
+
+    with httpx.Client(base_url=api_url, timeout=30) as http:
+        read_phase(http, users)  # fill the cache
+        before = read_phase(http, users)
+
+        rng = random.Random(0)
+        deleted = [(user_id, chats[user_id].pop()) for user_id in rng.sample(users, min(DELETES, USERS))]
+        for _, chat_id in deleted:
+            http.delete("/delete_chat", params={"chat_id": chat_id}).raise_for_status()
+        after = read_phase(http, users)
+
+        print("\n| Phase | user_chats hit rate |")
+        print("|---|---|")
+        print(f"| Before {len(deleted)} deletions | {before:.1%} |")
+        print(f"| After {len(deleted)} deletions | {after:.1%} |")
+        # With per-user invalidation only the first read of each affected user misses
+        expected = 1 - len(deleted) / (USERS * READS_PER_USER)
+        print(f"\nExpected after the storm with per-user invalidation: {expected:.1%}")
+
+        for user_id in users:
+            for chat_id in chats[user_id]:
+                http.delete("/delete_chat", params={"chat_id": chat_id})
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
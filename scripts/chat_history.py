@@ -1,30 +1,164 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, DESCENDING
+from pymongo.errors import BulkWriteError
 from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 import uuid
 
 # Initialize MongoDB connection
 client = MongoClient("mongodb://localhost:27017/")
 db = client.dh_users
 collection = db.history
+# One document per message, so reading the latest page never loads the whole chat
+messages_collection = db.messages
 
-def create_chat_window(user_id: str) -> str:
+DUPLICATE_KEY = 11000
+PREVIEW_CHARS = 120
+
+def ensure_indexes() -> None:
     """
-    Create a new chat window document
+    Create the indexes used by the chat history queries
+    """
+    collection.create_index("chat_id")
+    # Matches the (updated_at, chat_id) page order, so a page is an index scan with no in-memory sort
+    if "user_updated" in collection.index_information():
+        collection.drop_index("user_updated")  # Earlier layout without chat_id
+    collection.create_index(
+        [("user_id", 1), ("updated_at", DESCENDING), ("chat_id", DESCENDING)], name="user_updated_chat"
+    )
+    messages_collection.create_index(
+        [("chat_id", 1), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="chat_timestamp"
+    )
+
+def encode_cursor(message: dict) -> str:
+    """
+    Build the pagination cursor that continues before a message
+    
+    Args:
+        message: Message document
+        
+    Returns:
+        str: Opaque cursor
+    """
+    return f"{message['timestamp'].isoformat()}|{message['message_id']}"
+
+def encode_chat_cursor(chat: dict) -> str:
+    """
+    Build the pagination cursor that continues after a chat window summary
+    
+    Args:
+        chat: Chat window summary
+        
+    Returns:
+        str: Opaque cursor
+    """
+    return f"{chat['updated_at'].isoformat()}|{chat['chat_id']}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    timestamp, key = cursor.split("|", 1)
+    return datetime.fromisoformat(timestamp), key
+
+def _message_counts(chat_ids: list) -> dict:
+    """Stored message count per chat window, counted in one aggregation over the chat_timestamp index."""
+    if not chat_ids:
+        return {}
+    pipeline = [{"$match": {"chat_id": {"$in": chat_ids}}}, {"$group": {"_id": "$chat_id", "count": {"$sum": 1}}}]
+    return {group["_id"]: group["count"] for group in messages_collection.aggregate(pipeline)}
+
+def _summary_update(messages: list, inserted: int, message_count: Optional[int] = None) -> dict:
+    """
+    Update that folds appended messages into the chat window summary: the count is
+    incremented by the messages actually inserted, or set to `message_count` when
+    the stored messages were recounted.
+    """
+    last = max(messages, key=lambda m: m["timestamp"])
+    update = {
+        "$max": {"updated_at": last["timestamp"]},
+        "$set": {"last_message_preview": (last["response"] or "")[:PREVIEW_CHARS]},
+    }
+    if message_count is not None:
+        update["$set"]["message_count"] = message_count
+    else:
+        update["$inc"] = {"message_count": inserted}
+    if last.get("movie_title"):
+        update["$set"]["movie_title"] = last["movie_title"]
+    return update
+
+
+def new_chat_window(user_id: str) -> dict:
+    """
+    Build a new chat window document without writing it
     
     Args:
         user_id: Unique identifier for the user
         
     Returns:
-        str: Chat window ID
+        dict: Chat window document
     """
-    chat_window = {
+    return {
         "chat_id": str(uuid.uuid4()),
         "user_id": user_id,
         "created_at": datetime.now(),
         "updated_at": datetime.now(),
-        "messages": []
+        "message_count": 0,
+        "movie_title": "",
+        "last_message_preview": ""
     }
+
+def new_message(message: str, response: str, movie_title: str = "") -> dict:
+    """
+    Build a message document without writing it
     
+    Args:
+        message: User's message
+        response: System response
+        movie_title: Movie the conversation is about, if known
+        
+    Returns:
+        dict: Message document
+    """
+    now = datetime.now()
+    return {
+        "message_id": str(uuid.uuid4()),
+        "message": message,
+        "response": response,
+        "movie_title": movie_title,
+        # Mongo stores milliseconds; truncating here keeps cursors of buffered messages exact
+        "timestamp": now.replace(microsecond=now.microsecond // 1000 * 1000)
+    }
+
+def _message_documents(chat_id: str, messages: list) -> list:
+    return [dict(message, _id=message["message_id"], chat_id=chat_id) for message in messages]
+
+def _insert_messages(documents: list) -> Dict[str, int]:
+    """
+    Insert message documents, ignoring ones already written by an earlier attempt.
+    Returns the number of newly inserted messages per chat window.
+    """
+    duplicates = set()
+    try:
+        messages_collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        duplicates = {error["index"] for error in errors}
+    inserted: Dict[str, int] = {}
+    for i, document in enumerate(documents):
+        if i not in duplicates:
+            inserted[document["chat_id"]] = inserted.get(document["chat_id"], 0) + 1
+    return inserted
+
+def create_chat_window(user_id: str) -> str:
+    """
+    Create a new chat window document
+    
+    Args:
+        user_id: Unique identifier for the user
+        
+    Returns:
+        str: Chat window ID
+    """
+    chat_window = new_chat_window(user_id)
     collection.insert_one(chat_window)
     return chat_window["chat_id"]
 
@@ -40,57 +174,179 @@ def add_message(chat_id: str, message: str, response: str) -> bool:
     Returns:
         bool: True if successful, False otherwise
     """
-    message_data = {
-        "message_id": str(uuid.uuid4()),
-        "message": message,
-        "response": response,
-        "timestamp": datetime.now()
-    }
+    return add_messages(chat_id, [new_message(message, response)])
+
+def add_messages(chat_id: str, messages: list) -> bool:
+    """
+    Append several messages to a chat window
     
-    result = collection.update_one(
-        {"chat_id": chat_id},
-        {
-            "$push": {"messages": message_data},
-            "$set": {"updated_at": datetime.now()}
-        }
-    )
+    Args:
+        chat_id: Chat window identifier
+        messages: Message documents built by new_message
+        
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    if not messages:
+        return False
+    inserted = _insert_messages(_message_documents(chat_id, messages))
+    result = collection.update_one({"chat_id": chat_id}, _summary_update(messages, inserted.get(chat_id, 0)))
     
     return result.modified_count > 0
 
-def get_chat_history(chat_id: str) -> list:
+def write_batch(windows: list, messages: dict, recount: Iterable[str] = ()) -> None:
     """
-    Retrieve all messages from a chat window
+    Persist new chat windows and buffered messages in two bulk writes
+    
+    Windows are upserted and messages are keyed by their message_id, so a batch
+    that is retried after a failure does not create duplicates. Message counts
+    are incremented by the messages actually inserted; chats in `recount` are
+    recounted instead, since an earlier failed attempt may have inserted their
+    messages without updating the summary, or updated it already.
+    
+    Args:
+        windows: Chat window documents built by new_chat_window
+        messages: Chat window identifier -> message documents to append
+        recount: Chat window identifiers whose messages are being re-written
+    """
+    documents = [
+        document
+        for chat_id, chat_messages in messages.items()
+        for document in _message_documents(chat_id, chat_messages)
+    ]
+    inserted = _insert_messages(documents) if documents else {}
+    counts = _message_counts([chat_id for chat_id in set(recount) if messages.get(chat_id)])
+
+    operations = [
+        UpdateOne({"chat_id": window["chat_id"]}, {"$setOnInsert": window}, upsert=True)
+        for window in windows
+    ]
+    operations += [
+        UpdateOne({"chat_id": chat_id},
+                  _summary_update(chat_messages, inserted.get(chat_id, 0), counts.get(chat_id)))
+        for chat_id, chat_messages in messages.items() if chat_messages
+    ]
+    if operations:
+        collection.bulk_write(operations, ordered=True)
+
+def get_chat_history(chat_id: str, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Retrieve one page of messages from a chat window, newest page first
+    
+    The page is a single index range scan over (chat_id, timestamp), so its cost
+    does not depend on the length of the chat.
     
     Args:
         chat_id: Chat window identifier
+        limit: Maximum number of messages to return
+        cursor: Cursor returned with the previous page, None for the latest messages
         
     Returns:
-        list: List of messages in the chat window
+        tuple: Messages in chronological order, and the cursor for the older page (None if there is none)
     """
-    chat = collection.find_one({"chat_id": chat_id})
-    return chat["messages"] if chat else []
+    query = {"chat_id": chat_id}
+    if cursor:
+        timestamp, message_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": message_id}},
+        ]
+    page = list(
+        messages_collection.find(query, {"_id": 0, "chat_id": 0})
+        .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit + 1)
+    )
+    has_more = len(page) > limit
+    page = page[:limit]
+    next_cursor = encode_cursor(page[-1]) if has_more else None
+    return page[::-1], next_cursor
 
-def get_user_chats(user_id: str) -> list:
+def get_user_chats(user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
     """
-    Retrieve all chat windows for a user
+    Retrieve one page of chat window summaries for a user, most recently active first
+    
+    Only summary fields are read, so the cost does not depend on how many
+    messages the chats hold.
     
     Args:
         user_id: User identifier
+        limit: Maximum number of chats to return
+        cursor: Cursor returned with the previous page, None for the first page
         
     Returns:
-        list: List of chat windows
+        tuple: Chat window summaries, and the cursor for the next page (None if there is none)
     """
-    return list(collection.find({"user_id": user_id}))
+    query = {"user_id": user_id}
+    if cursor:
+        updated_at, chat_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "chat_id": {"$lt": chat_id}},
+        ]
+    page = list(
+        collection.find(query, {
+            "_id": 0, "chat_id": 1, "created_at": 1, "updated_at": 1,
+            "message_count": 1, "movie_title": 1, "last_message_preview": 1
+        })
+        .sort([("updated_at", DESCENDING), ("chat_id", DESCENDING)])
+        .limit(limit + 1)
+    )
+    has_more = len(page) > limit
+    page = page[:limit]
+    next_cursor = encode_chat_cursor(page[-1]) if has_more else None
+    return page, next_cursor
 
-def delete_chat(chat_id: str) -> bool:
+def delete_chat(chat_id: str) -> Optional[str]:
     """
-    Delete a chat window
+    Delete a chat window and its messages
     
     Args:
         chat_id: Chat window identifier
         
     Returns:
-        bool: True if successful, False otherwise
+        Optional[str]: ID of the user who owned the chat, None if it did not exist
     """
-    result = collection.delete_one({"chat_id": chat_id})
-    return result.deleted_count > 0
\ No newline at end of file
+    chat = collection.find_one_and_delete({"chat_id": chat_id}, {"user_id": 1})
+    messages_collection.delete_many({"chat_id": chat_id})
+    return chat["user_id"] if chat else None
+
+def migrate_embedded_messages() -> int:
+    """
+    Move messages from the old embedded `messages` arrays into the messages collection
+    
+    Returns:
+        int: Number of migrated messages
+    """
+    migrated = 0
+    for chat in collection.find({"messages": {"$exists": True}}, {"chat_id": 1, "messages": 1}):
+        if chat["messages"]:
+            _insert_messages(_message_documents(chat["chat_id"], chat["messages"]))
+            migrated += len(chat["messages"])
+        collection.update_one({"_id": chat["_id"]}, {"$unset": {"messages": ""}})
+    return migrated
+
+def backfill_chat_summaries() -> int:
+    """
+    Compute the summary fields of chat windows created before they existed
+    
+    Returns:
+        int: Number of updated chat windows
+    """
+    updated = 0
+    for chat in collection.find({"message_count": {"$exists": False}}, {"chat_id": 1}):
+        count = messages_collection.count_documents({"chat_id": chat["chat_id"]})
+        last = messages_collection.find_one(
+            {"chat_id": chat["chat_id"]}, sort=[("timestamp", DESCENDING), ("_id", DESCENDING)]
+        )
+        collection.update_one({"_id": chat["_id"]}, {"$set": {
+            "message_count": count,
+            "movie_title": (last or {}).get("movie_title", ""),
+            "last_message_preview": ((last or {}).get("response") or "")[:PREVIEW_CHARS],
+        }})
+        updated += 1
+    return updated
+
+if __name__ == "__main__":
+    ensure_indexes()
+    print(f"Migrated {migrate_embedded_messages()} messages")
+    print(f"Summarized {backfill_chat_summaries()} chat windows")
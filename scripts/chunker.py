@@ -0,0 +1,142 @@
+import re
+from typing import Callable, List, Tuple
+
+SCENE_HEADING = re.compile(r"^(?:\d+[A-Z]?\s+)?(?:INT\.|EXT\.|INT/EXT|EXT/INT|I/E)")
+TRANSITION = re.compile(r"^(?:FADE|CUT|DISSOLVE|SMASH|MATCH|WIPE)\b.*:?$|.*\bTO:$")
+PAGE_NUMBER = re.compile(r"^\d+\.?$")
+PARENTHETICAL = re.compile(r"\s*\(.*?\)\s*")
+
+
+def clean_text(text: str) -> str:
+    """Cleans script text to improve embeddings quality."""
+    text = re.sub(r'\r\n\s+\r\n', '\r\n\r\n', text)  # Remove extra whitespace
+    text = re.sub(r' +', ' ', text)  # Remove multiple spaces
+    text = re.sub(r'\s+([A-Z]+)\s+', r'\n\1: ', text)  # Format character names
+    text = re.sub(r'\s+([.,!?])', r'\1', text)  # Fix punctuation spacing
+    text = re.sub(r'\s+INT\.\s+', '\nINT. ', text)  # Standardize scene headings
+    text = re.sub(r'\s+EXT\.\s+', '\nEXT. ', text)
+    text = re.sub(r'\n\s*\d+\.\s*\n', '\n', text)  # Remove page numbers
+    return text.strip()
+
+
+def chunk_by_characters(content: str, chunk_size: int = 1000) -> List[str]:
+    """The original chunker: 50%-overlapping character windows over cleaned text."""
+    content = clean_text(content)
+    chunks = []
+    for i in range(0, len(content), chunk_size // 2):
+        chunk = content[i:i + chunk_size]
+        if len(chunk) >= 50:  # Skip very small chunks
+            chunks.append(chunk)
+    return chunks
+
+
+def approximate_tokens(text: str) -> int:
+    """Cheap token estimate (words and punctuation) for when no tokenizer is at hand."""
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def tokenizer_counter(tokenizer) -> Callable[[str], int]:
+    """Token counter for a Hugging Face tokenizer, e.g. `SentenceTransformer.tokenizer`."""
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _is_speaker_cue(line: str) -> bool:
+    name = PARENTHETICAL.sub(" ", line).strip()
+    return (bool(name) and name.isupper() and len(name.split()) <= 4 and len(name) <= 40
+            and not name.endswith(":") and not SCENE_HEADING.match(name) and not TRANSITION.match(name))
+
+
+def parse_screenplay(content: str) -> List[Tuple[str, str]]:
+    """
+    Splits raw screenplay text into `(kind, text)` blocks.
+
+    Kinds are "scene" (INT./EXT. headings), "dialogue" (one speaker turn, rendered
+    as "NAME: line") and "action" (description paragraphs). Transitions and page
+    numbers are dropped.
+    """
+    blocks = []
+    speaker = None
+    lines = []
+
+    def flush():
+        nonlocal speaker, lines
+        text = " ".join(lines).strip()
+        if speaker and text:
+            blocks.append(("dialogue", f"{speaker}: {text}"))
+        elif text:
+            blocks.append(("action", text))
+        speaker, lines = None, []
+
+    for raw_line in content.splitlines():
+        line = re.sub(r"\s+", " ", raw_line).strip()
+        if not line:
+            flush()
+        elif PAGE_NUMBER.match(line) or TRANSITION.match(line):
+            continue
+        elif SCENE_HEADING.match(line):
+            flush()
+            blocks.append(("scene", line))
+        elif _is_speaker_cue(line):
+            flush()
+            speaker = PARENTHETICAL.sub(" ", line).strip()
+        else:
+            lines.append(line)
+    flush()
+    return blocks
+
+
+def _split_long(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Splits one oversized block at sentence, then word, boundaries."""
+    pieces, current = [], []
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        words = [sentence] if count_tokens(sentence) <= max_tokens else sentence.split()
+        for word in words:
+            candidate = " ".join(current + [word])
+            if current and count_tokens(candidate) > max_tokens:
+                pieces.append(" ".join(current))
+                current = [word]
+            else:
+                current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def chunk_screenplay(content: str, max_tokens: int = 384, overlap_tokens: int = 48, min_tokens: int = 64,
+                     count_tokens: Callable[[str], int] = approximate_tokens) -> List[str]:
+    """
+    Packs screenplay blocks into chunks of at most `max_tokens` tokens.
+
+    Chunks never split a speaker turn unless the turn alone exceeds the budget, and a
+    scene heading starts a new chunk once the current one holds `min_tokens`. The only
+    overlap is the previous chunk's last block, carried over when it is no longer than
+    `overlap_tokens` and no scene boundary was crossed.
+    """
+    chunks = []
+    current: List[Tuple[str, int]] = []
+    current_tokens = 0
+
+    def emit():
+        text = "\n".join(piece for piece, _ in current)
+        if len(text) >= 50:  # Skip very small chunks
+            chunks.append(text)
+
+    for kind, text in parse_screenplay(content):
+        tokens = count_tokens(text)
+        pieces = [(text, tokens)] if tokens <= max_tokens else [
+            (piece, count_tokens(piece)) for piece in _split_long(text, max_tokens, count_tokens)
+        ]
+        for piece, piece_tokens in pieces:
+            new_scene = kind == "scene" and current_tokens >= min_tokens
+            if current and (new_scene or current_tokens + piece_tokens > max_tokens):
+                emit()
+                tail = current[-1]
+                if not new_scene and tail[1] <= overlap_tokens and tail[1] + piece_tokens <= max_tokens:
+                    current, current_tokens = [tail], tail[1]
+                else:
+                    current, current_tokens = [], 0
+            current.append((piece, piece_tokens))
+            current_tokens += piece_tokens
+    if current:
+        emit()
+    return chunks
@@ -0,0 +1,78 @@
+import json
+import os
+import random
+import sys
+import time
+
+from sentence_transformers import SentenceTransformer
+from chunker import chunk_by_characters, chunk_screenplay, tokenizer_counter
+
+EMBEDDING_DIM = 1024
+SAMPLE_SIZE = 512
+
+
+def load_contents(directory_path):
+    contents = []
+    for filename in sorted(os.listdir(directory_path)):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory_path, filename), 'r', encoding='utf-8') as f:
+                contents.append(json.load(f)['content'])
+    return contents
+
+
+def measure(name, chunk_fn, contents, model, count_tokens):
+    """Chunks every script with `chunk_fn` and estimates index size and embedding time."""
+    start = time.perf_counter()
+    chunks = [chunk for content in contents for chunk in chunk_fn(content)]
+    chunk_seconds = time.perf_counter() - start
+
+    tokens = [count_tokens(chunk) for chunk in chunks]
+    metadata_bytes = sum(len(chunk.encode('utf-8')) for chunk in chunks)
+
+    # Embedding cost is measured on a sample and extrapolated to the whole corpus
+    sample = random.Random(0).sample(chunks, min(SAMPLE_SIZE, len(chunks)))
+    start = time.perf_counter()
+    model.encode(sample, batch_size=64, normalize_embeddings=True, show_progress_bar=False)
+    encode_seconds = (time.perf_counter() - start) * len(chunks) / max(len(sample), 1)
+
+    return {
+        "chunker": name,
+        "vectors": len(chunks),
+        "avg_tokens": sum(tokens) / max(len(tokens), 1),
+        "truncated": sum(1 for t in tokens if t > model.max_seq_length),
+        "vector_mb": len(chunks) * EMBEDDING_DIM * 4 / 1e6,
+        "metadata_mb": metadata_bytes / 1e6,
+        "chunk_seconds": chunk_seconds,
+        "encode_seconds": encode_seconds,
+    }
+
+
+def main(directory_path='../movie_scripts'):
+    """Compares the character-window chunker with the screenplay-aware chunker."""
+    model = SentenceTransformer("BAAI/bge-large-en-v1.5")
+    count_tokens = tokenizer_counter(model.tokenizer)
+    contents = load_contents(directory_path)
+    print(f"Comparing chunkers over {len(contents)} scripts...")
+
+    rows = [
+        measure("characters (1000 chars, 50% overlap)", chunk_by_characters, contents, model, count_tokens),
+        measure("screenplay (384 tokens)",
+                lambda content: chunk_screenplay(content, max_tokens=384, count_tokens=count_tokens),
+                contents, model, count_tokens),
+    ]
+
+    print("\n| Chunker | Vectors | Avg tokens | Over model limit | Vector index (MB, fp32) | "
+          "Chunk text (MB) | Chunking (s) | Est. embedding (s) |")
+    print("|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        print(f"| {row['chunker']} | {row['vectors']} | {row['avg_tokens']:.0f} | {row['truncated']} | "
+              f"{row['vector_mb']:.1f} | {row['metadata_mb']:.1f} | {row['chunk_seconds']:.1f} | "
+              f"{row['encode_seconds']:.0f} |")
+
+    before, after = rows
+    if before["vectors"]:
+        print(f"\nVector count change: {100 * (after['vectors'] - before['vectors']) / before['vectors']:+.1f}%")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from google.genai import types
+
+import scripts.gemini as gemini
+import scripts.metrics as metrics
+from scripts.chunker import approximate_tokens
+
+CONVERSATION_KEEP_TURNS = int(os.getenv("CONVERSATION_KEEP_TURNS", "6"))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "3000"))
+SUMMARY_MAX_WORDS = int(os.getenv("CONVERSATION_SUMMARY_WORDS", "150"))
+
+SUMMARY_PROMPT = """Update the running summary of a roleplay conversation between a user and a movie character.
+Keep names, facts, promises and the emotional tone; drop pleasantries. Answer with the summary only, at most {words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+"""
+
+
+class Conversation:
+    """
+    Token-budgeted prompt state for one websocket chat.
+
+    The retrieved movie context and a running summary of older turns live in the
+    system instruction, so they are sent once per request instead of once per
+    turn. Only the last `keep_turns` turns are meant to be replayed verbatim;
+    older ones, and any that would push the prompt over `token_budget`, are
+    marked for `compact` to fold into the summary. Marked turns stay in the
+    prompt until their summary exists, so the model never loses a turn.
+    """
+
+    def __init__(self, system_instruction: str, keep_turns: int = 6, token_budget: int = 3000,
+                 count_tokens: Callable[[str], int] = approximate_tokens):
+        self.system_instruction = system_instruction
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+
+        self.movie_title = ""
+        self.context = ""
+        self.summary = ""
+        # Unsummarized turns, oldest first; the first `_pending` are marked for compaction
+        self.turns: List[Tuple[str, str]] = []
+        self._pending = 0
+        self._turn = 0
+        self._compact_lock = asyncio.Lock()
+
+    def set_context(self, movie_title: str, context: str) -> None:
+        self.movie_title = movie_title
+        self.context = context
+
+    def config(self) -> types.GenerateContentConfig:
+        instruction = f"{self.system_instruction}\nmovie title: {self.movie_title}\ncontext: {self.context}\n"
+        if self.summary:
+            instruction += f"\nsummary of the earlier conversation: {self.summary}\n"
+        return types.GenerateContentConfig(system_instruction=instruction)
+
+    def contents(self, message: str) -> List[types.Content]:
+        contents = []
+        for user_text, model_text in self.turns:
+            contents.append(types.Content(role="user", parts=[types.Part(text=user_text)]))
+            contents.append(types.Content(role="model", parts=[types.Part(text=model_text)]))
+        contents.append(types.Content(role="user", parts=[types.Part(text=message)]))
+        return contents
+
+    def estimate_tokens(self, message: str) -> int:
+        """Estimated prompt size: instruction, context, summary, verbatim turns and the new message."""
+        fixed = self.count_tokens(f"{self.system_instruction} {self.movie_title} {self.context} {self.summary}")
+        return fixed + sum(self.count_tokens(f"{u} {m}") for u, m in self.turns) + self.count_tokens(message)
+
+    def _fit(self, message: str) -> int:
+        """Mark the oldest turns for compaction until the prompt without them fits the token budget."""
+        estimate = self.estimate_tokens(message)
+        verbatim = estimate - sum(self.count_tokens(f"{u} {m}") for u, m in self.turns[:self._pending])
+        while self._pending < len(self.turns) and verbatim > self.token_budget:
+            user_text, model_text = self.turns[self._pending]
+            verbatim -= self.count_tokens(f"{user_text} {model_text}")
+            self._pending += 1
+        # If summaries keep failing, drop the oldest marked turns rather than grow the prompt without bound
+        while self._pending > 2 * self.keep_turns:
+            user_text, model_text = self.turns.pop(0)
+            self._pending -= 1
+            estimate -= self.count_tokens(f"{user_text} {model_text}")
+            print("Conversation: dropped an unsummarized turn, summaries are failing")
+        return estimate
+
+    @property
+    def turn_count(self) -> int:
+        return self._turn
+
+    def _append(self, message: str, reply: str) -> None:
+        self._turn += 1
+        self.turns.append((message, reply))
+        self._pending = max(self._pending, len(self.turns) - self.keep_turns)
+
+    def add_turn(self, message: str, reply: str) -> None:
+        """Record a turn answered without calling the model, e.g. from the first-turn cache."""
+        self._append(message, reply)
+        print(f"Turn {self._turn}: served from cache, 0 prompt tokens")
+
+    def _record(self, message: str, reply: str, estimate: int, usage) -> None:
+        self._append(message, reply)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        print(f"Turn {self._turn}: {prompt_tokens if prompt_tokens is not None else '?'} prompt tokens "
+              f"(estimated {estimate}), {len(self.turns)} verbatim turns, "
+              f"summary {self.count_tokens(self.summary)} tokens")
+
+    async def send(self, message: str) -> str:
+        estimate = self._fit(message)
+        with metrics.timer("gemini"):
+            response = await gemini.generate(self.contents(message), self.config())
+        reply = response.text or ""
+        self._record(message, reply, estimate, response.usage_metadata)
+        return reply
+
+    async def stream(self, message: str) -> AsyncIterator[str]:
+        """Yield the reply text as it is generated; the turn is recorded once the stream ends."""
+        estimate = self._fit(message)
+        parts = []
+        usage = None
+        start = time.perf_counter()
+        # Only generation is timed, not the time the caller spends forwarding chunks
+        generating = 0.0
+        async for chunk in gemini.stream_generate(self.contents(message), self.config()):
+            generating += time.perf_counter() - start
+            if chunk.usage_metadata is not None:
+                usage = chunk.usage_metadata
+            if chunk.text:
+                if not parts:
+                    metrics.observe("gemini_first_token", generating)
+                parts.append(chunk.text)
+                yield chunk.text
+            start = time.perf_counter()
+        metrics.observe("gemini", generating + time.perf_counter() - start)
+        self._record(message, "".join(parts), estimate, usage)
+
+    async def compact(self) -> Optional[str]:
+        """
+        Fold the marked turns into the running summary with one model call. Safe to run
+        as a background task: concurrent calls return at once while one is in flight,
+        and the turns leave the prompt only together with their new summary.
+        """
+        if not self._pending or self._compact_lock.locked():
+            return None
+        async with self._compact_lock:
+            folded = self.turns[:self._pending]
+            turns = "\n".join(f"user: {u}\ncharacter: {m}" for u, m in folded)
+            prompt = SUMMARY_PROMPT.format(words=SUMMARY_MAX_WORDS, summary=self.summary or "(none)", turns=turns)
+            try:
+                with metrics.timer("gemini_summary"):
+                    response = await gemini.generate(prompt)
+            except Exception as e:
+                # The turns stay in the prompt and are retried after the next turn
+                print(f"ERROR: Conversation summary failed: {e}")
+                return None
+            # Turns may have been appended, or marked ones dropped, while the summary was generated
+            folded_ids = {id(turn) for turn in folded}
+            kept = [turn for turn in self.turns if id(turn) not in folded_ids]
+            self._pending -= len(self.turns) - len(kept)
+            self.turns = kept
+            self.summary = (response.text or self.summary).strip()
+            return self.summary
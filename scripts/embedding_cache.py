@@ -0,0 +1,131 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+import redis
+import redis.asyncio as aioredis
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase and collapse whitespace so trivially different queries share one entry."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def query_hash(text: str) -> str:
+    """Stable key for a query, independent of its casing and spacing."""
+    return hashlib.sha1(normalize_query(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Query-embedding cache with an in-process LRU and an optional Redis tier.
+
+    Vectors are kept as float32 in memory and as float16 bytes in Redis, keyed on
+    the normalized query hash, so the same query never pays the embedding round
+    trip twice regardless of the `top_k` it is searched with. The Redis tier is
+    only used by `aget`/`aput` from event-loop code; `get`/`put` stay in process.
+    """
+
+    def __init__(self, max_entries: int = 10000, async_redis_client: Optional[aioredis.Redis] = None,
+                 ttl: int = 86400, prefix: str = "embedding:"):
+        self.max_entries = max_entries
+        self.async_redis_client = async_redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._redis_hits = 0
+        self._misses = 0
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Return the in-process cached embedding for `text`, or None on a miss."""
+        key = query_hash(text)
+        vector = self._lookup(key)
+        if vector is None:
+            with self._lock:
+                self._misses += 1
+        return vector
+
+    async def aget(self, text: str) -> Optional[np.ndarray]:
+        """Return the cached embedding for `text` from memory or Redis, or None on a miss."""
+        key = query_hash(text)
+        vector = self._lookup(key)
+        if vector is not None:
+            return vector
+        return self._record_tier(key, await self._aredis_get(key))
+
+    def put(self, text: str, vector) -> np.ndarray:
+        """Store the embedding for `text` in process and return it as a float32 array."""
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(query_hash(text), vector)
+        return vector
+
+    async def aput(self, text: str, vector) -> np.ndarray:
+        """Store the embedding for `text` in every tier and return it as a float32 array."""
+        key = query_hash(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+        await self._aredis_set(key, vector)
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._redis_hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "redis_tier": self.async_redis_client is not None,
+                "hits": self._hits,
+                "redis_hits": self._redis_hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits + self._redis_hits) / lookups if lookups else 0.0,
+            }
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            return vector
+
+    def _record_tier(self, key: str, vector: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        with self._lock:
+            if vector is None:
+                self._misses += 1
+                return None
+            self._redis_hits += 1
+        self._remember(key, vector)
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def _aredis_get(self, key: str) -> Optional[np.ndarray]:
+        if self.async_redis_client is None:
+            return None
+        try:
+            data = await self.async_redis_client.get(self.prefix + key)
+        except redis.RedisError as e:
+            print(f"ERROR: Embedding cache Redis error: {e}")
+            return None
+        if not data:
+            return None
+        return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+
+    async def _aredis_set(self, key: str, vector: np.ndarray) -> None:
+        if self.async_redis_client is None:
+            return
+        try:
+            await self.async_redis_client.setex(self.prefix + key, self.ttl, vector.astype(np.float16).tobytes())
+        except redis.RedisError as e:
+            print(f"ERROR: Embedding cache Redis error: {e}")
@@ -0,0 +1,169 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = "BAAI/bge-large-en-v1.5"
+
+
+class EmbeddingEngine:
+    """
+    Process-wide SentenceTransformer shared by all request threads.
+
+    The model is loaded once, and concurrent encode requests are collected by a
+    single worker thread into micro-batches so each `model.encode` call serves
+    every caller that arrived within `max_wait_ms`.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, device: Optional[str] = None):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.device = device
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_batch = 0
+        self._last_batch = 0
+        self._encode_seconds = 0.0
+        self._batch_sizes = {}
+
+    def load(self) -> SentenceTransformer:
+        """Load the model if it is not resident yet and return it."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+                    print(f"Loaded {self.model_name} in {time.perf_counter() - start:.2f}s")
+        return self._model
+
+    def warmup(self) -> None:
+        """Load the model and run one encode so the first request pays no setup cost."""
+        self.encode("warmup")
+
+    def submit(self, text: str) -> Future:
+        """Queue `text` for encoding and return a future resolving to its normalized embedding."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None):
+        """Encode a single text, blocking until its micro-batch has been processed."""
+        return self.submit(text).result(timeout)
+
+    def encode_many(self, texts: List[str], timeout: Optional[float] = None) -> list:
+        """Encode several texts, letting the worker batch them together."""
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout) for future in futures]
+
+    def stats(self) -> dict:
+        """Queue depth and batch-size statistics for tuning `max_batch_size`/`max_wait_ms`."""
+        with self._stats_lock:
+            return {
+                "model": self.model_name,
+                "loaded": self._model is not None,
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+                "max_observed_batch": self._max_batch,
+                "last_batch_size": self._last_batch,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+                "encode_seconds_total": round(self._encode_seconds, 4),
+            }
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-engine", daemon=True)
+                self._worker.start()
+
+    @staticmethod
+    def _accept(batch: list, item: tuple) -> None:
+        # Futures cancelled while queued (e.g. by an awaiting coroutine) are dropped here;
+        # accepted ones can no longer be cancelled
+        if item[1].set_running_or_notify_cancel():
+            batch.append(item)
+
+    def _collect_batch(self) -> list:
+        batch = []
+        while not batch:
+            self._accept(batch, self._queue.get())
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                self._accept(batch, self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _deliver(future: Future, result=None, error: Optional[BaseException] = None) -> None:
+        """Resolve one future; a failure here must not take down the worker or the rest of the batch."""
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except Exception as e:
+            print(f"ERROR: Could not deliver embedding result: {e}")
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+            try:
+                model = self.load()
+                start = time.perf_counter()
+                embeddings = model.encode(
+                    texts,
+                    batch_size=len(texts),
+                    normalize_embeddings=True,
+                    show_progress_bar=False,
+                )
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                for _, future in batch:
+                    self._deliver(future, error=e)
+                continue
+
+            self._record_batch(len(batch), elapsed)
+            for (_, future), embedding in zip(batch, embeddings):
+                self._deliver(future, embedding)
+
+    def _record_batch(self, size: int, elapsed: float) -> None:
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._last_batch = size
+            self._max_batch = max(self._max_batch, size)
+            self._encode_seconds += elapsed
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+
+
+engine = EmbeddingEngine(
+    max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH", "32")),
+    max_wait_ms=float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5")),
+    device=os.getenv("EMBEDDING_DEVICE") or None,
+)
@@ -7,9 +7,18 @@ load_dotenv()
 gemKey = os.getenv("GEMINI_API_KEY")
 
 client = genai.Client(api_key=gemKey)
+MODEL = "gemini-2.0-flash"
 
 def send_message(message, chat):
     """Send a message to the chat model and return the response"""
     response = chat.send_message(message)
     return response
 
+async def generate(contents, config=None):
+    """Generate a complete response for `contents` (a prompt string or a list of `types.Content`)"""
+    return await client.aio.models.generate_content(model=MODEL, contents=contents, config=config)
+
+async def stream_generate(contents, config=None):
+    """Generate a response for `contents` and yield the chunks as they arrive"""
+    async for chunk in await client.aio.models.generate_content_stream(model=MODEL, contents=contents, config=config):
+        yield chunk
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failed (or slower than `slow_call_seconds`) calls the
+    circuit opens and callers are told to skip the remote endpoint. Once
+    `reset_timeout` seconds have passed a single trial call is let through; its
+    outcome closes the circuit again or re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 slow_call_seconds: Optional[float] = None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._trips = 0
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        """Return True if the caller may use the remote endpoint right now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record(self, ok: bool, elapsed: float = 0.0) -> None:
+        """Record the outcome of a call that `allow()` let through."""
+        if ok and self.slow_call_seconds is not None and elapsed > self.slow_call_seconds:
+            ok = False
+        with self._lock:
+            self._trial_in_flight = False
+            if ok:
+                self._state = self.CLOSED
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._trips += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """End a call that `allow()` let through without an outcome (e.g. it was cancelled)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "trips": self._trips,
+                "rejected_calls": self._rejected,
+            }
+
+
+class HFEmbeddingClient:
+    """
+    Async client for the Hugging Face feature-extraction endpoint.
+
+    Uses one keep-alive `httpx.AsyncClient` per process, bounds every call with a
+    deadline on the whole request (httpx timeouts only bound each phase, so a
+    trickling response could outlive them), and reports through a `CircuitBreaker` so callers can fall back to
+    the local model while the endpoint is slow or failing. `embed` returns None
+    whenever the remote vector is unavailable. Point `url` at a local stand-in
+    server to exercise it without the real endpoint.
+    """
+
+    def __init__(self, url: str, token: Optional[str] = None, timeout: float = 5.0,
+                 max_connections: int = 20, max_keepalive: int = 10,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.breaker = breaker or CircuitBreaker(slow_call_seconds=timeout / 2)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._calls = 0
+        self._failures = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(headers=self.headers, limits=self.limits, timeout=self.timeout)
+        return self._client
+
+    async def embed(self, text: str, deadline: Optional[float] = None) -> Optional[list]:
+        """Embed `text` remotely within `deadline` seconds, or return None."""
+        if not self.breaker.allow():
+            return None
+
+        self._calls += 1
+        start = time.perf_counter()
+        vector = None
+        completed = False
+        try:
+            response = await asyncio.wait_for(
+                self._get_client().post(self.url, json={"inputs": text}), deadline or self.timeout
+            )
+            response.raise_for_status()
+            vector = response.json()
+            completed = True
+        except Exception as e:
+            # Any failure, the deadline included, falls back to the local model and counts against the breaker
+            print(f"ERROR: HF embedding request failed: {e!r}")
+            completed = True
+        finally:
+            # A cancelled call says nothing about the endpoint, but must not leave a
+            # half-open trial in flight forever
+            if not completed:
+                self.breaker.release()
+
+        ok = type(vector) is list
+        if not ok:
+            self._failures += 1
+        self.breaker.record(ok, time.perf_counter() - start)
+        return vector if ok else None
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {"calls": self._calls, "failures": self._failures, "breaker": self.breaker.stats()}
@@ -0,0 +1,156 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+
+import redis
+
+import scripts.cache as cache
+import scripts.chat_history as chat_history
+import scripts.metrics as metrics
+
+HISTORY_FLUSH_MESSAGES = int(os.getenv("HISTORY_FLUSH_MESSAGES", "20"))
+HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", "1.0"))
+
+
+class HistoryWriter:
+    """
+    Write-behind buffer for chat history.
+
+    `create_chat_window` and `add_message` only touch in-memory buffers, so the
+    websocket loop never waits on Mongo. A background task writes everything
+    buffered in one bulk write every `flush_seconds`, or sooner once
+    `flush_messages` messages are waiting. A failed write is put back in the
+    buffer and retried; `close` drains the buffer on shutdown. After each write
+    the cached pages of the affected chats and their owners are invalidated.
+    """
+
+    def __init__(self, flush_messages: int = 20, flush_seconds: float = 1.0):
+        self.flush_messages = flush_messages
+        self.flush_seconds = flush_seconds
+
+        self._windows: Dict[str, dict] = {}
+        self._messages: Dict[str, List[dict]] = {}
+        self._owners: Dict[str, str] = {}
+        # Chat windows whose websocket has closed; their owner is forgotten once everything is written
+        self._closed: Set[str] = set()
+        # Chat windows whose messages were re-queued after a failed write; their counts are recounted
+        self._recount: Set[str] = set()
+        self._buffered = 0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._written = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def create_chat_window(self, user_id: str) -> str:
+        """Register a new chat window; it is written with the next flush."""
+        window = chat_history.new_chat_window(user_id)
+        self._windows[window["chat_id"]] = window
+        self._owners[window["chat_id"]] = user_id
+        return window["chat_id"]
+
+    def add_message(self, chat_id: str, message: str, response: str, movie_title: str = "") -> None:
+        self._messages.setdefault(chat_id, []).append(chat_history.new_message(message, response, movie_title))
+        self._buffered += 1
+        if self._buffered >= self.flush_messages:
+            self._wakeup.set()
+
+    def pending_messages(self, chat_id: str) -> List[dict]:
+        """Messages of a chat window that have not been written yet."""
+        return list(self._messages.get(chat_id, []))
+
+    async def flush(self, chat_id: Optional[str] = None) -> bool:
+        """Write the buffered windows and messages, or only those of `chat_id`. Returns False on failure."""
+        async with self._flush_lock:
+            if chat_id is not None:
+                # Flushed on disconnect; nothing more is added to this chat window
+                self._closed.add(chat_id)
+            if chat_id is None:
+                windows, self._windows = self._windows, {}
+                messages, self._messages = self._messages, {}
+            else:
+                window = self._windows.pop(chat_id, None)
+                windows = {chat_id: window} if window else {}
+                chat_messages = self._messages.pop(chat_id, None)
+                messages = {chat_id: chat_messages} if chat_messages else {}
+            count = sum(len(chat_messages) for chat_messages in messages.values())
+            self._buffered -= count
+            if not windows and not messages:
+                self._forget_closed()
+                return True
+
+            try:
+                with metrics.timer("mongo_write"):
+                    await asyncio.to_thread(chat_history.write_batch, list(windows.values()), messages,
+                                            self._recount & set(messages))
+            except Exception as e:
+                print(f"ERROR: Chat history flush failed, {count} messages re-queued: {e}")
+                self._failed_flushes += 1
+                self._recount.update(messages)
+                self._windows.update(windows)
+                for buffered_chat_id, chat_messages in messages.items():
+                    self._messages[buffered_chat_id] = chat_messages + self._messages.get(buffered_chat_id, [])
+                self._buffered += count
+                return False
+
+            self._written += count
+            self._recount.difference_update(messages)
+            self._flushes += 1
+            chat_ids = set(windows) | set(messages)
+            tags = [f"chat:{written_chat_id}" for written_chat_id in messages]
+            tags += sorted({f"user:{self._owners[written_chat_id]}"
+                            for written_chat_id in chat_ids if written_chat_id in self._owners})
+            self._forget_closed()
+        try:
+            await cache.invalidate(*tags)
+        except redis.RedisError as e:
+            print(f"ERROR: Could not invalidate chat caches: {e}")
+        return True
+
+    def _forget_closed(self) -> None:
+        """Drop the owners of closed chat windows that have nothing left to write."""
+        for closed_chat_id in list(self._closed):
+            if closed_chat_id not in self._windows and closed_chat_id not in self._messages:
+                self._owners.pop(closed_chat_id, None)
+                self._closed.discard(closed_chat_id)
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def close(self, retries: int = 3) -> None:
+        """Stop the background task and write everything still buffered."""
+        # The task is woken rather than cancelled so an in-flight write is never abandoned
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        for attempt in range(retries):
+            if await self.flush():
+                return
+            await asyncio.sleep(2 ** attempt)
+        print(f"ERROR: {self._buffered} chat history messages could not be written")
+
+    def stats(self) -> dict:
+        return {
+            "buffered_messages": self._buffered,
+            "buffered_windows": len(self._windows),
+            "written_messages": self._written,
+            "flushes": self._flushes,
+            "failed_flushes": self._failed_flushes,
+        }
+
+
+writer = HistoryWriter(flush_messages=HISTORY_FLUSH_MESSAGES, flush_seconds=HISTORY_FLUSH_SECONDS)
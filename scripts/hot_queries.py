@@ -0,0 +1,51 @@
+import os
+from typing import List
+
+import redis
+
+import scripts.cache as cache
+
+# Hand-picked hot queries, one per line ("#" starts a comment)
+HOT_QUERIES_PATH = os.getenv("HOT_QUERIES_PATH", "hot_queries.txt")
+# Live traffic is counted in a Redis sorted set so warmup can replay the most frequent queries
+HOT_QUERIES_RECORD = os.getenv("HOT_QUERIES_RECORD", "1") == "1"
+HOT_QUERIES_LIMIT = int(os.getenv("HOT_QUERIES_LIMIT", "500"))
+HOT_QUERIES_KEY = "hot_queries"
+# The set is trimmed well above the warmup limit so new queries get a chance to climb
+HOT_QUERIES_TRACKED = HOT_QUERIES_LIMIT * 20
+
+
+def load_manifest(path: str = HOT_QUERIES_PATH) -> List[str]:
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+async def record(query: str) -> None:
+    """Count one occurrence of `query` in live traffic."""
+    if not HOT_QUERIES_RECORD:
+        return
+    try:
+        async with cache.client.pipeline(transaction=False) as pipe:
+            pipe.zincrby(HOT_QUERIES_KEY, 1, query)
+            pipe.zremrangebyrank(HOT_QUERIES_KEY, 0, -(HOT_QUERIES_TRACKED + 1))
+            await pipe.execute()
+    except redis.RedisError as e:
+        print(f"ERROR: Could not record hot query: {e}")
+
+
+async def top(limit: int = HOT_QUERIES_LIMIT) -> List[str]:
+    """Most frequent live queries, most frequent first."""
+    try:
+        return await cache.client.zrevrange(HOT_QUERIES_KEY, 0, limit - 1)
+    except redis.RedisError as e:
+        print(f"ERROR: Could not read hot queries: {e}")
+        return []
+
+
+async def load(limit: int = HOT_QUERIES_LIMIT) -> List[str]:
+    """The manifest queries followed by the top live queries, without duplicates, up to `limit`."""
+    queries = dict.fromkeys(load_manifest())
+    queries.update(dict.fromkeys(await top(limit)))
+    return list(queries)[:limit]
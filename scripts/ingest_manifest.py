@@ -0,0 +1,58 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Tuple
+
+
+def content_hash(text: str) -> str:
+    """Short, stable hash of a piece of content."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class IngestManifest:
+    """
+    Persisted per-script and per-chunk content hashes for incremental ingest.
+
+    An ingester hashes each script file and skips it when the hash matches the
+    previous run; for changed scripts it compares per-chunk hashes to find which
+    ids to re-embed and which to delete. Nothing is written until `save`, which
+    callers only do after the run succeeded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.scripts: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.scripts = json.load(f).get("scripts", {})
+
+    def script_unchanged(self, filename: str, script_hash: str) -> bool:
+        entry = self.scripts.get(filename)
+        return entry is not None and entry["hash"] == script_hash
+
+    def diff_chunks(self, filename: str, chunk_hashes: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Return ids that are new or changed, and ids that no longer exist in the script."""
+        previous = self.scripts.get(filename, {}).get("chunks", {})
+        changed = [chunk_id for chunk_id, h in chunk_hashes.items() if previous.get(chunk_id) != h]
+        removed = [chunk_id for chunk_id in previous if chunk_id not in chunk_hashes]
+        return changed, removed
+
+    def removed_scripts(self, filenames: Iterable[str]) -> List[str]:
+        current = set(filenames)
+        return [filename for filename in self.scripts if filename not in current]
+
+    def chunk_ids(self, filename: str) -> List[str]:
+        return list(self.scripts.get(filename, {}).get("chunks", {}))
+
+    def update(self, filename: str, script_hash: str, chunk_hashes: Dict[str, str]) -> None:
+        self.scripts[filename] = {"hash": script_hash, "chunks": chunk_hashes}
+
+    def forget(self, filename: str) -> None:
+        self.scripts.pop(filename, None)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"scripts": self.scripts}, f)
+        os.replace(tmp_path, self.path)
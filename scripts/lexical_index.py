@@ -0,0 +1,174 @@
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower().replace("’", "'"))
+
+
+def encode_records(records: dict) -> np.ndarray:
+    """JSON records as UTF-8 bytes; a NumPy string array would store them as UTF-32."""
+    return np.frombuffer(json.dumps(records).encode("utf-8"), dtype=np.uint8)
+
+
+def decode_records(array: np.ndarray) -> dict:
+    # Indexes saved before records were UTF-8 encoded hold a unicode scalar
+    return json.loads(array.tobytes().decode("utf-8") if array.dtype == np.uint8 else str(array))
+
+
+def reciprocal_rank_fusion(results: Iterable[dict], top_k: int, k: int = 60) -> dict:
+    """
+    Merge ranked `{"matches": [...]}` results by reciprocal rank fusion.
+
+    Each match scores `sum(1 / (k + rank))` over the lists it appears in; the fused
+    score replaces the stage-specific one.
+    """
+    fused: Dict[str, dict] = {}
+    scores: Counter = Counter()
+    namespace = None
+    for result in results:
+        namespace = namespace or result.get("namespace")
+        for rank, match in enumerate(result.get("matches", []), start=1):
+            fused.setdefault(match["id"], match)
+            scores[match["id"]] += 1.0 / (k + rank)
+    matches = [dict(fused[match_id], score=score) for match_id, score in scores.most_common(top_k)]
+    return {"matches": matches, "namespace": namespace}
+
+
+class BM25Index:
+    """
+    In-process BM25 index over the ingested chunks.
+
+    Postings are stored as flat arrays (`offsets` into `doc_ids`/`tfs` per term), so
+    a query only touches the postings of its own terms and the whole index saves
+    to, and loads from, a single `.npz` file.
+    """
+
+    def __init__(self, ids: List[str], metadata: List[dict], terms: List[str], offsets: np.ndarray,
+                 doc_ids: np.ndarray, tfs: np.ndarray, doc_lengths: np.ndarray,
+                 k1: float = 1.2, b: float = 0.75, namespace: str = "movie_dialogues"):
+        self.ids = ids
+        self.metadata = metadata
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.namespace = namespace
+        average = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+        # Per-document part of the BM25 denominator, computed once
+        self._norms = (k1 * (1 - b + b * doc_lengths / (average or 1.0))).astype(np.float32)
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, records: Iterable[Tuple[str, dict]], **kwargs) -> "BM25Index":
+        """Index `(id, metadata)` records on their `metadata["text"]`."""
+        ids, metadata, lengths = [], [], []
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc, (record_id, record_metadata) in enumerate(records):
+            tokens = tokenize(record_metadata.get("text", ""))
+            ids.append(record_id)
+            metadata.append(record_metadata)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        doc_ids = np.fromiter((doc for term in terms for doc, _ in postings[term]), dtype=np.int32, count=int(offsets[-1]))
+        tfs = np.fromiter((min(tf, 65535) for term in terms for _, tf in postings[term]), dtype=np.uint16,
+                          count=int(offsets[-1]))
+        return cls(ids, metadata, terms, offsets, doc_ids, tfs, np.asarray(lengths, dtype=np.float32), **kwargs)
+
+    @classmethod
+    def from_artifact(cls, path: str, **kwargs) -> "BM25Index":
+        """Index the chunk records of an artifact written by `EmbeddingArtifactWriter`."""
+        def records():
+            with open(os.path.join(path, "records.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    yield record["id"], record["metadata"]
+        return cls.build(records(), **kwargs)
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths,
+                 params=np.array([self.k1, self.b]),
+                 records=encode_records({"ids": self.ids, "metadata": self.metadata, "terms": list(self.vocab),
+                                         "namespace": self.namespace}))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as data:
+            records = decode_records(data["records"])
+            k1, b = (float(value) for value in data["params"])
+            return cls(records["ids"], records["metadata"], records["terms"], data["offsets"], data["doc_ids"],
+                       data["tfs"], data["doc_lengths"], k1=k1, b=b, namespace=records["namespace"])
+
+    def idf(self, term_id: int) -> float:
+        df = int(self.offsets[term_id + 1] - self.offsets[term_id])
+        return math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+
+    def specificity(self, query: str) -> float:
+        """Summed IDF of the query's distinct indexed terms; low for common phrases like "I know"."""
+        return sum(self.idf(self.vocab[term]) for term in set(tokenize(query)) if term in self.vocab)
+
+    def search(self, query: str, top_k: int = 5) -> dict:
+        """BM25 top-k in the same shape as a vector store query result."""
+        term_ids = {self.vocab[term] for term in tokenize(query) if term in self.vocab}
+        if not term_ids or not self.count:
+            return {"matches": [], "namespace": self.namespace}
+
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            idf = self.idf(term_id)
+            # Each document appears once per term, so plain fancy indexing accumulates correctly
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self._norms[docs])
+
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        if top_k <= 0:
+            return {"matches": [], "namespace": self.namespace}
+        rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        rows = rows[np.argsort(-scores[rows])]
+        return {
+            "matches": [{"id": self.ids[row], "score": float(scores[row]), "metadata": self.metadata[row]}
+                        for row in rows],
+            "namespace": self.namespace,
+        }
+
+    @staticmethod
+    def contains_phrase(query: str, match: dict, min_terms: int = 4) -> bool:
+        """True when the match's text contains the whole query as a phrase (e.g. an exact quote)."""
+        terms = tokenize(query)
+        if len(terms) < min_terms:
+            return False
+        return f" {' '.join(terms)} " in f" {' '.join(tokenize(match['metadata'].get('text', '')))} "
+
+
+if __name__ == "__main__":
+    # Usage: python lexical_index.py ../embeddings ../lexical_index.npz
+    args = sys.argv[1:]
+    artifact_path = args[0] if args else "../embeddings"
+    index_path = args[1] if len(args) > 1 else "../lexical_index.npz"
+    index = BM25Index.from_artifact(artifact_path)
+    index.save(index_path)
+    print(f"Indexed {index.count} chunks ({len(index.vocab)} terms) into {index_path}")
@@ -0,0 +1,111 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+PREFIX = "movie_chatbot_"
+# Upper bounds in seconds, from in-process index lookups up to slow model calls
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus bucket layout."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Timings:
+    """Stage durations of one HTTP request or websocket turn, for Server-Timing and turn logs."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        """Milliseconds per stage, plus the elapsed `total`."""
+        stages = {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+        stages["total"] = round((time.perf_counter() - self.start) * 1000, 1)
+        return stages
+
+    def header(self) -> str:
+        return ", ".join(f"{stage};dur={ms}" for stage, ms in self.as_dict().items())
+
+    def summary(self) -> str:
+        return " ".join(f"{stage}={ms:.0f}ms" for stage, ms in self.as_dict().items())
+
+
+_stages: Dict[str, Histogram] = {}
+_lock = threading.Lock()
+_current: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar("timings", default=None)
+
+
+def start_timings() -> Timings:
+    """Collect the stages observed from here on in this task (and the tasks and threads it starts)."""
+    timings = Timings()
+    _current.set(timings)
+    return timings
+
+
+def observe(stage: str, seconds: float) -> None:
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = Histogram()
+        histogram.observe(seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timer(stage: str) -> Iterator[None]:
+    """Time the enclosed block as `stage`, including when it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def render(counters: Optional[Dict[str, Iterable[Tuple[Dict[str, str], float]]]] = None) -> str:
+    """
+    Prometheus text exposition of the stage histograms, followed by `counters`
+    given as `{name: [(labels, value), ...]}`; names are prefixed with PREFIX.
+    """
+    name = f"{PREFIX}stage_duration_seconds"
+    lines: List[str] = [f"# HELP {name} Duration of each request stage.", f"# TYPE {name} histogram"]
+    with _lock:
+        for stage, histogram in sorted(_stages.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels({'stage': stage, 'le': le})} {cumulative}")
+            lines.append(f"{name}_sum{_labels({'stage': stage})} {histogram.sum}")
+            lines.append(f"{name}_count{_labels({'stage': stage})} {histogram.count}")
+
+    for counter, samples in (counters or {}).items():
+        lines.append(f"# TYPE {PREFIX}{counter} counter")
+        lines.extend(f"{PREFIX}{counter}{_labels(labels)} {value}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
@@ -1,11 +1,15 @@
 import os
+import sys
 import google.genai as genai
 import chromadb
 from dotenv import load_dotenv
+import hashlib
 import json
+import tempfile
+import threading
 from tqdm import tqdm
-import concurrent.futures
 import time
+from ingest_manifest import IngestManifest, content_hash
 
 load_dotenv()
 
@@ -21,6 +25,55 @@ def get_gemini_embedding(text):
     embedding = gemini_client.models.embed_content(model="text-embedding-004", contents=text)
     return embedding.embeddings[0].values
 
+def get_gemini_embeddings(texts):
+    """Embeds a whole batch of texts with one multi-content request."""
+    response = gemini_client.models.embed_content(model="text-embedding-004", contents=texts)
+    return [embedding.values for embedding in response.embeddings]
+
+def stand_in_embeddings(texts, dim=768):
+    """Deterministic local embedding function for measuring ingest throughput without the API."""
+    embeddings = []
+    for text in texts:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        embeddings.append([(digest[i % len(digest)] - 128) / 128 for i in range(dim)])
+    return embeddings
+
+def is_rate_limited(error):
+    return getattr(error, "code", None) == 429 or "RESOURCE_EXHAUSTED" in str(error)
+
+class AdaptiveRateLimiter:
+    """
+    Additive-increase/multiplicative-decrease request pacing.
+
+    Each successful request raises the allowed rate by `step` requests/sec (up to
+    `max_rate`); a rate-limit response halves it. `wait` sleeps only as long as the
+    current rate requires, instead of a fixed pause between batches.
+    """
+
+    def __init__(self, rate=2.0, min_rate=0.1, max_rate=20.0, step=0.2):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next_at - now)
+            self._next_at = max(now, self._next_at) + 1 / self.rate
+        if delay:
+            time.sleep(delay)
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
 # Extract dialogues from JSON
 def extract_dialogues_from_json(json_data):
     movie_title = json_data.get("movie_title", "Unknown Movie")
@@ -46,87 +99,131 @@ def extract_dialogues_from_json(json_data):
 
     return movie_title, dialogues
 
-# Process a single dialogue
-def process_single_dialogue(args):
-    dialogue_id, movie_title, speaker, dialogue = args
-    
+def embed_with_backoff(texts, embed_fn, limiter, max_retries=6):
+    """Embeds `texts` in one request, slowing down and retrying while rate limited."""
+    for attempt in range(max_retries):
+        limiter.wait()
+        try:
+            embeddings = embed_fn(texts)
+            limiter.success()
+            return embeddings
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_retries - 1:
+                raise
+            limiter.throttled()
+
+# Process a batch of dialogues with one existence check, one embedding request and one add
+def process_batch(batch, embed_fn=get_gemini_embeddings, limiter=None, target=None):
+    """Returns (processed, skipped, errors) for the batch."""
+    target = target if target is not None else collection
+    limiter = limiter or AdaptiveRateLimiter()
+    ids = [dialogue_id for dialogue_id, _, _, _ in batch]
+
     try:
-        # Check if the embedding already exists in ChromaDB
-        existing_results = collection.get(ids=[dialogue_id], include=["embeddings"])
-
-        if existing_results and "embeddings" in existing_results and len(existing_results["embeddings"]) > 0:
-            return f"Skipped existing: {movie_title}, Speaker: {speaker}"
-        else:
-            # Generate new embedding
-            embedding = get_gemini_embedding(dialogue)
-
-            # Store new embedding in ChromaDB
-            collection.add(
-                ids=[dialogue_id],  
-                embeddings=[embedding],
-                metadatas=[{"title": movie_title, "speaker": speaker, "dialogue": dialogue}]
+        existing = set(target.get(ids=ids, include=[])["ids"])
+        missing = [task for task in batch if task[0] not in existing]
+        if missing:
+            embeddings = embed_with_backoff([dialogue for _, _, _, dialogue in missing], embed_fn, limiter)
+            target.add(
+                ids=[dialogue_id for dialogue_id, _, _, _ in missing],
+                embeddings=embeddings,
+                metadatas=[{"title": movie_title, "speaker": speaker, "dialogue": dialogue}
+                           for _, movie_title, speaker, dialogue in missing]
             )
-            
-            return f"Processed: {movie_title}, Speaker: {speaker}"
+        return len(missing), len(batch) - len(missing), 0
     except Exception as e:
-        return f"Error processing {dialogue_id}: {str(e)}"
-
-def process_batch(batch):
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        batch_results = list(executor.map(process_single_dialogue, batch))
-        results.extend(batch_results)
-    return results
+        print(f"Error processing batch starting at {ids[0]}: {str(e)}")
+        return 0, 0, len(batch)
 
-def store_json_dialogues_in_chroma(folder_path, batch_size=20):
+def store_json_dialogues_in_chroma(folder_path, batch_size=100, manifest_path="../manifests/store_chroma.json",
+                                   embed_fn=get_gemini_embeddings, target=None):
     # Get all JSON files
     json_files = [f for f in os.listdir(folder_path) if f.endswith(".json")]
     print(f"Found {len(json_files)} JSON files")
     
     all_dialogue_tasks = []
     
-    # First, extract all dialogues from all files
+    # Only scripts whose content changed since the last successful run are re-processed
+    manifest = IngestManifest(manifest_path)
+    updates = {}
+    stale_ids = []
+    unchanged = 0
+    for filename in manifest.removed_scripts(json_files):
+        stale_ids.extend(manifest.chunk_ids(filename))
+
+    # First, extract all dialogues from the new or changed files
     for filename in tqdm(json_files, desc="Preparing files"):
         file_path = os.path.join(folder_path, filename)
         with open(file_path, "r", encoding="utf-8") as file:
-            try:
-                json_data = json.load(file)
-                movie_title, dialogues = extract_dialogues_from_json(json_data)
-                
-                # Create tasks for each dialogue
-                for i, (speaker, dialogue) in enumerate(dialogues):
-                    dialogue_id = f"{movie_title}_{i}"
+            raw = file.read()
+        script_hash = content_hash(raw)
+        if manifest.script_unchanged(filename, script_hash):
+            unchanged += 1
+            continue
+        try:
+            json_data = json.loads(raw)
+            movie_title, dialogues = extract_dialogues_from_json(json_data)
+            dialogue_hashes = {f"{movie_title}_{i}": content_hash(f"{speaker}\n{dialogue}")
+                               for i, (speaker, dialogue) in enumerate(dialogues)}
+            changed, removed = manifest.diff_chunks(filename, dialogue_hashes)
+            changed = set(changed)
+            previous_ids = set(manifest.chunk_ids(filename))
+            # Changed dialogues are deleted first so they are written again below
+            stale_ids.extend(removed)
+            stale_ids.extend(i for i in changed if i in previous_ids)
+            updates[filename] = (script_hash, dialogue_hashes)
+
+            # Create tasks for each new or changed dialogue
+            for i, (speaker, dialogue) in enumerate(dialogues):
+                dialogue_id = f"{movie_title}_{i}"
+                if dialogue_id in changed:
                     all_dialogue_tasks.append((dialogue_id, movie_title, speaker, dialogue))
-            except json.JSONDecodeError:
-                print(f"Error: Could not parse JSON in {filename}")
-    
+        except json.JSONDecodeError:
+            print(f"Error: Could not parse JSON in {filename}")
+
+    print(f"{unchanged} unchanged files skipped, {len(stale_ids)} stale dialogues to delete")
+    target = target if target is not None else collection
+    if stale_ids:
+        target.delete(ids=stale_ids)
+
     total_dialogues = len(all_dialogue_tasks)
     print(f"Total dialogues to process: {total_dialogues}")
     
-    # Process in batches
-    results = []
+    # Process in batches, paced by the adaptive rate limiter instead of fixed sleeps
+    limiter = AdaptiveRateLimiter()
+    processed = skipped = errors = 0
+    start = time.perf_counter()
     for i in tqdm(range(0, total_dialogues, batch_size), desc="Processing batches"):
         batch = all_dialogue_tasks[i:i+batch_size]
-        batch_results = process_batch(batch)
-        results.extend(batch_results)
-        
-        # Add a small delay between batches to avoid overwhelming the API
-        if i + batch_size < total_dialogues:
-            time.sleep(1)
+        batch_processed, batch_skipped, batch_errors = process_batch(batch, embed_fn, limiter, target)
+        processed += batch_processed
+        skipped += batch_skipped
+        errors += batch_errors
+    elapsed = time.perf_counter() - start
     
-    # Count processed vs skipped
-    processed = sum(1 for r in results if r.startswith("Processed"))
-    skipped = sum(1 for r in results if r.startswith("Skipped"))
-    errors = sum(1 for r in results if r.startswith("Error"))
-    
-    print(f"Processing complete:")
+    print(f"Processing complete in {elapsed:.1f}s ({total_dialogues / elapsed if elapsed else 0:.1f} dialogues/sec):")
     print(f"- {processed} new dialogues processed")
     print(f"- {skipped} existing dialogues skipped")
     print(f"- {errors} errors encountered")
     
     if errors > 0:
         print("Some errors occurred during processing. Check logs for details.")
+        print("Manifest not updated; the affected files will be retried on the next run.")
+        return
+
+    for filename in manifest.removed_scripts(json_files):
+        manifest.forget(filename)
+    for filename, (script_hash, dialogue_hashes) in updates.items():
+        manifest.update(filename, script_hash, dialogue_hashes)
+    manifest.save()
 
 if __name__ == "__main__":
-    # Run the script with batch processing
-    store_json_dialogues_in_chroma("../movie_scripts", batch_size=20)
\ No newline at end of file
+    if "--stand-in" in sys.argv:
+        # Measure ingest throughput against an in-memory collection and local embeddings
+        store_json_dialogues_in_chroma("../movie_scripts",
+                                       manifest_path=os.path.join(tempfile.mkdtemp(), "manifest.json"),
+                                       embed_fn=stand_in_embeddings,
+                                       target=chromadb.EphemeralClient().get_or_create_collection("stand_in"))
+    else:
+        # Run the script with batch processing
+        store_json_dialogues_in_chroma("../movie_scripts", batch_size=100)
\ No newline at end of file
@@ -1,67 +1,126 @@
 import os
 import json
-import re
-from typing import List, Dict
+import queue
+import threading
+import time
+from typing import List, Dict, Iterable, Iterator, Optional
 from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from dotenv import load_dotenv
-from pinecone import Pinecone
 from sentence_transformers import SentenceTransformer
+from vector_store import EmbeddingArtifactWriter, LocalStore, MappedStore, PineconeStore, VectorStore
+from ingest_manifest import IngestManifest, content_hash
+from chunker import chunk_screenplay, tokenizer_counter
+from lexical_index import BM25Index
 from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import torch
 
 # Load environment variables
 load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 
-# Initialize Pinecone client
-pc = Pinecone(PINECONE_API_KEY)
-index = pc.Index(host="https://baai-n5yfgj0.svc.aped-4627-b74a.pinecone.io")
+# Content hashes of the last successful run; INGEST_FULL=1 clears the namespace and re-ingests everything
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "../manifests/process_scripts_v2.json")
+INGEST_FULL = os.getenv("INGEST_FULL", "0") == "1"
+
+# Compact memory-mappable copy of the embeddings (see vector_store.MappedStore); empty path disables it
+EMBEDDING_ARTIFACT_PATH = os.getenv("EMBEDDING_ARTIFACT_PATH", "../embeddings")
+EMBEDDING_ARTIFACT_DTYPE = os.getenv("EMBEDDING_ARTIFACT_DTYPE", "int8")
+
+# Vector store: the hosted Pinecone index, or an in-process index saved to LOCAL_INDEX_PATH.
+# With `mapped` the embedding artifact is what gets served, so only the artifact is written.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "../local_index.npz")
+store: Optional[VectorStore]
+if VECTOR_BACKEND == "local":
+    store = LocalStore.load(LOCAL_INDEX_PATH) if os.path.exists(LOCAL_INDEX_PATH) else LocalStore()
+elif VECTOR_BACKEND == "mapped":
+    if not EMBEDDING_ARTIFACT_PATH:
+        raise ValueError("VECTOR_BACKEND=mapped needs EMBEDDING_ARTIFACT_PATH")
+    store = None
+else:
+    store = PineconeStore(PINECONE_API_KEY)
+# BM25 index over the same chunks, rebuilt from the artifact after each run (see lexical_index.py)
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "../lexical_index.npz")
 
 # Load Sentence Transformer model (CUDA if available)
 
 model = SentenceTransformer("BAAI/bge-large-en-v1.5",device="cuda")
+count_tokens = tokenizer_counter(model.tokenizer)
 
-def clean_text(text: str) -> str:
-    """Cleans script text to improve embeddings quality."""
-    text = re.sub(r'\r\n\s+\r\n', '\r\n\r\n', text)  # Remove extra whitespace
-    text = re.sub(r' +', ' ', text)  # Remove multiple spaces
-    text = re.sub(r'\s+([A-Z]+)\s+', r'\n\1: ', text)  # Format character names
-    text = re.sub(r'\s+([.,!?])', r'\1', text)  # Fix punctuation spacing
-    text = re.sub(r'\s+INT\.\s+', '\nINT. ', text)  # Standardize scene headings
-    text = re.sub(r'\s+EXT\.\s+', '\nEXT. ', text)
-    text = re.sub(r'\n\s*\d+\.\s*\n', '\n', text)  # Remove page numbers
-    return text.strip()
-
-def load_and_chunk_scripts(directory_path: str, chunk_size: int = 1000) -> List[Dict]:
-    """Loads movie scripts, cleans them, and splits into overlapping chunks."""
-    all_chunks = []
-    chunk_id = 0
-    
+# Token budget per chunk; stays below the model's 512-token sequence limit
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "384"))
+
+def iter_scripts(directory_path: str) -> Iterator[Dict]:
+    """Yields movie scripts one file at a time."""
     for filename in os.listdir(directory_path):
         if filename.endswith('.json'):
             file_path = os.path.join(directory_path, filename)
             with open(file_path, 'r', encoding='utf-8') as f:
-                script_data = json.load(f)
-            
-            content = clean_text(script_data['content'])
-            movie_title = script_data['movie_title']
-
-            # Split content into overlapping chunks
-            for i in range(0, len(content), chunk_size // 2):
-                chunk = content[i:i + chunk_size]
-                if len(chunk) >= 50:  # Skip very small chunks
-                    all_chunks.append({
-                        'id': f"{movie_title}_{chunk_id}",
-                        'text': chunk,
-                        'movie_title': movie_title
-                    })
-                    chunk_id += 1
-                    
-    return all_chunks
-
-
-def process_batch(batch: List[Dict]) -> List[Dict]:
+                yield json.load(f)
+
+def chunk_script(script_data: Dict, max_tokens: int = CHUNK_MAX_TOKENS) -> Iterator[Dict]:
+    """Splits a script into token-bounded chunks along scene and speaker boundaries.
+
+    Chunk ids are numbered per script, so they stay the same across runs as long
+    as the script does not change.
+    """
+    movie_title = script_data['movie_title']
+    chunks = chunk_screenplay(script_data['content'], max_tokens=max_tokens, count_tokens=count_tokens)
+    for chunk_id, chunk in enumerate(chunks):
+        yield {
+            'id': f"{movie_title}_{chunk_id}",
+            'text': chunk,
+            'movie_title': movie_title
+        }
+
+def iter_chunks(scripts: Iterable[Dict], max_tokens: int = CHUNK_MAX_TOKENS) -> Iterator[Dict]:
+    """Lazily splits scripts into chunks."""
+    for script_data in scripts:
+        yield from chunk_script(script_data, max_tokens)
+
+def load_and_chunk_scripts(directory_path: str, max_tokens: int = CHUNK_MAX_TOKENS) -> List[Dict]:
+    """Loads movie scripts and splits them into chunks."""
+    return list(iter_chunks(iter_scripts(directory_path), max_tokens))
+
+def plan_ingest(directory_path: str, manifest: IngestManifest, max_tokens: int = CHUNK_MAX_TOKENS) -> Dict[str, Dict]:
+    """
+    Compares every script against the manifest.
+
+    Returns an entry per new or changed script with its script hash, chunk hashes,
+    the chunk ids that need embedding and the ids that no longer exist. Only one
+    script is held in memory at a time and chunk texts are not kept.
+    """
+    plan = {}
+    for filename in os.listdir(directory_path):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(directory_path, filename), 'r', encoding='utf-8') as f:
+            raw = f.read()
+        script_hash = content_hash(raw)
+        if manifest.script_unchanged(filename, script_hash):
+            continue
+
+        chunk_hashes = {c['id']: content_hash(c['text']) for c in chunk_script(json.loads(raw), max_tokens)}
+        changed, removed = manifest.diff_chunks(filename, chunk_hashes)
+        plan[filename] = {"hash": script_hash, "chunks": chunk_hashes, "changed": changed, "removed": removed}
+    return plan
+
+def iter_planned_chunks(directory_path: str, plan: Dict[str, Dict], max_tokens: int = CHUNK_MAX_TOKENS) -> Iterator[Dict]:
+    """Yields only the chunks `plan_ingest` marked as new or changed."""
+    for filename, entry in plan.items():
+        changed = set(entry["changed"])
+        if not changed:
+            continue
+        with open(os.path.join(directory_path, filename), 'r', encoding='utf-8') as f:
+            script_data = json.load(f)
+        for chunk in chunk_script(script_data, max_tokens):
+            if chunk['id'] in changed:
+                yield chunk
+
+
+def process_batch(batch: List[Dict], artifact: Optional[EmbeddingArtifactWriter] = None) -> List[Dict]:
     """Generates embeddings for a batch efficiently on GPU."""
     with torch.no_grad():  # Disables gradient calculation
         embeddings = model.encode(
@@ -71,13 +130,19 @@ def process_batch(batch: List[Dict]) -> List[Dict]:
             show_progress_bar=False  # Disable tqdm inside encode
         ).half()  # Convert to FP16 if supported
 
+    # One device-to-host copy for the whole batch instead of one per row
+    embeddings = embeddings.cpu().numpy()
+    metadata = [{"text": d['text'], "movie_title": d['movie_title']} for d in batch]
+    if artifact is not None:
+        artifact.append([d['id'] for d in batch], embeddings, metadata)
+
     return [
         {
             "id": d['id'],
-            "values": e.cpu().tolist(),  # Move tensor to CPU only when needed
-            "metadata": {"text": d['text'], "movie_title": d['movie_title']}
+            "values": values,
+            "metadata": m
         }
-        for d, e in zip(batch, embeddings)
+        for d, values, m in zip(batch, embeddings.astype(np.float32).tolist(), metadata)
     ]
 
 
@@ -88,25 +153,166 @@ def process_batch(batch: List[Dict]) -> List[Dict]:
     
 #     with ThreadPoolExecutor(max_workers=num_workers) as executor:
 #         for batch_vectors in tqdm(executor.map(process_batch, batches), total=len(batches)):
-#             index.upsert(vectors=batch_vectors, namespace="movie_dialogues")
+#             store.upsert(batch_vectors, namespace="movie_dialogues")
+
+_DONE = object()
 
-def process_chunks_parallel(chunks: List[Dict], batch_size: int = 128):
-    """Processes chunks efficiently using optimized GPU and upsert settings."""
-    vectors = []
+class PipelineStats:
+    """Per-stage item counts, busy time and backpressure (time blocked on a full downstream queue)."""
 
-    for i in tqdm(range(0, len(chunks), batch_size), total=len(chunks) // batch_size, desc="Processing batches"):
-        batch = chunks[i:i + batch_size]
-        vectors.extend(process_batch(batch))  # Fast GPU encoding
+    def __init__(self, stages: Iterable[str]):
+        self.start = time.perf_counter()
+        self.items = {stage: 0 for stage in stages}
+        self.busy = {stage: 0.0 for stage in stages}
+        self.blocked = {stage: 0.0 for stage in stages}
+        self._lock = threading.Lock()
 
-    upsert_vectors_parallel(vectors)  # Optimized upsert
+    def record(self, stage: str, items: int = 0, busy: float = 0.0, blocked: float = 0.0) -> None:
+        with self._lock:
+            self.items[stage] += items
+            self.busy[stage] += busy
+            self.blocked[stage] += blocked
 
-def upsert_vectors_parallel(vectors: List[Dict], batch_size: int = 500):
-    """Upserts vectors to Pinecone in parallel batches."""
-    batches = [vectors[i:i + batch_size] for i in range(0, len(vectors), batch_size)]
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        done = self.items["upsert"]
+        lines = [f"Ingested {done} chunks in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f} chunks/sec)"]
+        for stage in self.items:
+            lines.append(f"- {stage}: {self.items[stage]} items, busy {self.busy[stage]:.1f}s, "
+                         f"blocked on downstream {self.blocked[stage]:.1f}s")
+        return "\n".join(lines)
 
-    with ThreadPoolExecutor(max_workers=8) as executor:  # Use 8 threads for parallel uploads
-        list(tqdm(executor.map(lambda batch: index.upsert(vectors=batch, namespace="movie_dialogues"), batches),
-                  total=len(batches), desc="Upserting to Pinecone"))
+def run_pipeline(chunks: Iterable[Dict], batch_size: int = 128, queue_size: int = 8, upsert_workers: int = 8,
+                 artifact: Optional[EmbeddingArtifactWriter] = None) -> PipelineStats:
+    """
+    Streams chunks through encode and upsert stages connected by bounded queues.
+
+    A reader thread batches the chunk iterator, the calling thread encodes on the
+    GPU, and `upsert_workers` threads write to the vector store (if any). Each queue holds at
+    most `queue_size` batches, so memory stays flat regardless of corpus size and a
+    slow stage applies backpressure to the ones before it.
+    """
+    encode_queue = queue.Queue(maxsize=queue_size)
+    upsert_queue = queue.Queue(maxsize=queue_size)
+    stats = PipelineStats(("chunk", "encode", "upsert"))
+    errors = []
+    stop = threading.Event()
+
+    def put(q: queue.Queue, item, stage: str) -> None:
+        start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        stats.record(stage, blocked=time.perf_counter() - start)
+
+    def get(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def read():
+        try:
+            batch = []
+            start = time.perf_counter()
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) == batch_size:
+                    stats.record("chunk", len(batch), busy=time.perf_counter() - start)
+                    put(encode_queue, batch, "chunk")
+                    batch = []
+                    start = time.perf_counter()
+            if batch:
+                stats.record("chunk", len(batch), busy=time.perf_counter() - start)
+                put(encode_queue, batch, "chunk")
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(encode_queue, _DONE, "chunk")
+
+    def upsert():
+        while True:
+            vectors = get(upsert_queue)
+            if vectors is _DONE:
+                return
+            try:
+                start = time.perf_counter()
+                if store is not None:
+                    store.upsert(vectors, namespace="movie_dialogues")
+                stats.record("upsert", len(vectors), busy=time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+    reader = threading.Thread(target=read, name="ingest-reader", daemon=True)
+    reader.start()
+    with ThreadPoolExecutor(max_workers=upsert_workers) as executor:
+        upserters = [executor.submit(upsert) for _ in range(upsert_workers)]
+        with tqdm(desc="Ingesting", unit="chunk") as progress:
+            try:
+                while True:
+                    batch = get(encode_queue)
+                    if batch is _DONE:
+                        break
+                    start = time.perf_counter()
+                    vectors = process_batch(batch, artifact)  # Fast GPU encoding
+                    stats.record("encode", len(batch), busy=time.perf_counter() - start)
+                    put(upsert_queue, vectors, "encode")
+                    progress.update(len(batch))
+                    progress.set_postfix(encode_queue=encode_queue.qsize(), upsert_queue=upsert_queue.qsize())
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                for _ in upserters:
+                    put(upsert_queue, _DONE, "encode")
+        for upserter in upserters:
+            upserter.result()
+    reader.join()
+
+    if errors:
+        raise errors[0]
+    print(stats.report())
+    return stats
+
+def process_chunks_parallel(chunks: Iterable[Dict], batch_size: int = 128, replaced_ids: Optional[set] = None):
+    """Processes chunks efficiently using optimized GPU and upsert settings.
+
+    With `replaced_ids` (an incremental run) rows of the previous embedding artifact
+    whose ids are not replaced or deleted are carried over into the new one.
+    """
+    artifact = None
+    if EMBEDDING_ARTIFACT_PATH:
+        artifact = EmbeddingArtifactWriter(EMBEDDING_ARTIFACT_PATH, model.get_sentence_embedding_dimension(),
+                                           EMBEDDING_ARTIFACT_DTYPE)
+
+    try:
+        stats = run_pipeline(chunks, batch_size=batch_size, artifact=artifact)
+        if artifact is not None and replaced_ids is not None:
+            if os.path.exists(EMBEDDING_ARTIFACT_PATH):
+                kept = artifact.copy_from(MappedStore(EMBEDDING_ARTIFACT_PATH), replaced_ids)
+                print(f"Kept {kept} unchanged embeddings from the previous artifact")
+            else:
+                print("No previous embedding artifact found; run with INGEST_FULL=1 to rebuild it completely")
+    except Exception:
+        if artifact is not None:
+            artifact.abort()
+        raise
+
+    if artifact is not None:
+        artifact.close()
+        print(f"Wrote {artifact.count} embeddings to {EMBEDDING_ARTIFACT_PATH}")
+        if LEXICAL_INDEX_PATH:
+            lexical_index = BM25Index.from_artifact(EMBEDDING_ARTIFACT_PATH)
+            lexical_index.save(LEXICAL_INDEX_PATH)
+            print(f"Indexed {lexical_index.count} chunks for lexical search in {LEXICAL_INDEX_PATH}")
+    return stats
 
 
 
@@ -114,10 +320,11 @@ def search_similar_dialogue(query: str, top_k: int = 5, namespace: str = "movie_
     """Searches for similar movie dialogues based on input query."""
     query_embedding = model.encode([query], normalize_embeddings=True)[0].tolist()
 
-    results = index.query(
-        namespace=namespace,
-        vector=query_embedding,
+    search_store = store if store is not None else MappedStore(EMBEDDING_ARTIFACT_PATH)
+    results = search_store.query(
+        query_embedding,
         top_k=top_k,
+        namespace=namespace,
         include_values=True,
         include_metadata=True
     )
@@ -132,13 +339,48 @@ def search_similar_dialogue(query: str, top_k: int = 5, namespace: str = "movie_
         for match in results['matches']
     ]
 
+def ingest(directory_path: str = '../movie_scripts', full: bool = INGEST_FULL):
+    """Embeds and upserts only scripts that changed since the last run and deletes vectors of removed ones."""
+    manifest = IngestManifest(MANIFEST_PATH)
+    if full:
+        print("Full ingest: clearing the namespace")
+        if store is not None:
+            store.clear(namespace="movie_dialogues")
+        manifest.scripts = {}
+    elif not manifest.scripts:
+        print("No manifest found: ingesting everything. Set INGEST_FULL=1 to also clear vectors from older runs.")
+    incremental = bool(manifest.scripts)
+
+    plan = plan_ingest(directory_path, manifest)
+    removed_scripts = manifest.removed_scripts(f for f in os.listdir(directory_path) if f.endswith('.json'))
+    stale_ids = [i for f in removed_scripts for i in manifest.chunk_ids(f)]
+    stale_ids += [i for entry in plan.values() for i in entry["removed"]]
+    changed_ids = [i for entry in plan.values() for i in entry["changed"]]
+    print(f"{len(plan)} new or changed scripts, {len(removed_scripts)} removed; "
+          f"{len(changed_ids)} chunks to embed, {len(stale_ids)} to delete")
+    if not changed_ids and not stale_ids:
+        manifest.save()
+        return
+
+    # Runs even with only deletions so the embedding artifact drops the stale rows
+    print("Streaming changed chunks through embedding and upserting...")
+    process_chunks_parallel(iter_planned_chunks(directory_path, plan),
+                            replaced_ids=set(changed_ids) | set(stale_ids) if incremental else None)
+    # The artifact already dropped the stale rows; with `mapped` there is no store to delete from
+    if stale_ids and store is not None:
+        store.delete(stale_ids, namespace="movie_dialogues")
+    if isinstance(store, LocalStore):
+        store.save(LOCAL_INDEX_PATH)
+
+    for filename in removed_scripts:
+        manifest.forget(filename)
+    for filename, entry in plan.items():
+        manifest.update(filename, entry["hash"], entry["chunks"])
+    manifest.save()
+
 def main():
     """Main function to load scripts, generate embeddings, and perform search."""
-    print("Loading and chunking scripts...")
-    chunks = load_and_chunk_scripts('../movie_scripts')
-
-    print("\nProcessing chunks in parallel and generating embeddings...")
-    process_chunks_parallel(chunks)
+    ingest('../movie_scripts')
 
     # Example search
     query = "What do you hate about me?"
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def normalize(text: str) -> List[str]:
+    """Lower-cased words without punctuation, so near-verbatim quotes hash alike."""
+    return WORD.findall(text.lower().replace("’", "'"))
+
+
+def encode_records(records: dict) -> np.ndarray:
+    """JSON records as UTF-8 bytes; a NumPy string array would store them as UTF-32."""
+    return np.frombuffer(json.dumps(records).encode("utf-8"), dtype=np.uint8)
+
+
+def decode_records(array: np.ndarray) -> dict:
+    # Indexes saved before records were UTF-8 encoded hold a unicode scalar
+    return json.loads(array.tobytes().decode("utf-8") if array.dtype == np.uint8 else str(array))
+
+
+def hash_words(words: List[str]) -> int:
+    return int.from_bytes(hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class QuoteIndex:
+    """
+    Exact and partial quote lookup over parsed `(speaker, dialogue)` records.
+
+    Every dialogue line and each of its sentences is hashed after normalization
+    (an O(1) dict lookup once loaded), and every `shingle_size`-word window is
+    hashed for partial quotes (a binary search over a sorted array). Keys that
+    occur in more than one movie are dropped at build time, so a hit always
+    identifies a single movie.
+    """
+
+    def __init__(self, titles: List[str], title_ids: np.ndarray, seqs: np.ndarray, speakers: List[str],
+                 dialogues: List[str], exact_hashes: np.ndarray, exact_rows: np.ndarray,
+                 shingle_hashes: np.ndarray, shingle_rows: np.ndarray, shingle_size: int = 3, min_words: int = 3):
+        self.titles = titles
+        self.title_ids = title_ids
+        self.seqs = seqs
+        self.speakers = speakers
+        self.dialogues = dialogues
+        self.exact_hashes = exact_hashes
+        self.exact_rows = exact_rows
+        self.shingle_hashes = shingle_hashes
+        self.shingle_rows = shingle_rows
+        self.shingle_size = shingle_size
+        self.min_words = min_words
+        self._exact = dict(zip(exact_hashes.tolist(), exact_rows.tolist()))
+
+    @property
+    def count(self) -> int:
+        return len(self.dialogues)
+
+    @classmethod
+    def build(cls, scripts: Iterable[Tuple[str, List[Tuple[str, str]]]], shingle_size: int = 3,
+              min_words: int = 3) -> "QuoteIndex":
+        """Index `(movie_title, [(speaker, dialogue), ...])` as produced by `extract_dialogues_from_json`."""
+        titles, title_ids, seqs, speakers, dialogues = [], [], [], [], []
+        exact: Dict[int, Tuple[int, int]] = {}
+        shingles: Dict[int, Tuple[int, int]] = {}
+
+        def add(keys: Dict[int, Tuple[int, int]], key: int, row: int, title_id: int) -> None:
+            # -1 marks keys shared by several movies; the first row wins within a movie
+            previous = keys.get(key)
+            if previous is None:
+                keys[key] = (row, title_id)
+            elif previous[1] != title_id:
+                keys[key] = (-1, -1)
+
+        for movie_title, movie_dialogues in scripts:
+            title_id = len(titles)
+            titles.append(movie_title)
+            for seq, (speaker, dialogue) in enumerate(movie_dialogues):
+                row = len(dialogues)
+                title_ids.append(title_id)
+                seqs.append(seq)
+                speakers.append(speaker)
+                dialogues.append(dialogue)
+
+                words = normalize(dialogue)
+                for sentence in [dialogue] + SENTENCE_END.split(dialogue):
+                    sentence_words = normalize(sentence)
+                    if len(sentence_words) >= min_words:
+                        add(exact, hash_words(sentence_words), row, title_id)
+                for i in range(len(words) - shingle_size + 1):
+                    add(shingles, hash_words(words[i:i + shingle_size]), row, title_id)
+
+        def arrays(keys: Dict[int, Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+            kept = sorted((key, row) for key, (row, _) in keys.items() if row >= 0)
+            return (np.fromiter((key for key, _ in kept), dtype=np.uint64, count=len(kept)),
+                    np.fromiter((row for _, row in kept), dtype=np.int32, count=len(kept)))
+
+        return cls(titles, np.asarray(title_ids, dtype=np.int32), np.asarray(seqs, dtype=np.int32), speakers,
+                   dialogues, *arrays(exact), *arrays(shingles), shingle_size=shingle_size, min_words=min_words)
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, title_ids=self.title_ids, seqs=self.seqs,
+                 exact_hashes=self.exact_hashes, exact_rows=self.exact_rows,
+                 shingle_hashes=self.shingle_hashes, shingle_rows=self.shingle_rows,
+                 params=np.array([self.shingle_size, self.min_words]),
+                 records=encode_records({"titles": self.titles, "speakers": self.speakers,
+                                         "dialogues": self.dialogues}))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "QuoteIndex":
+        with np.load(path) as data:
+            records = decode_records(data["records"])
+            shingle_size, min_words = (int(value) for value in data["params"])
+            return cls(records["titles"], data["title_ids"], data["seqs"], records["speakers"], records["dialogues"],
+                       data["exact_hashes"], data["exact_rows"], data["shingle_hashes"], data["shingle_rows"],
+                       shingle_size=shingle_size, min_words=min_words)
+
+    def _shingle_row(self, key: int) -> Optional[int]:
+        i = int(np.searchsorted(self.shingle_hashes, np.uint64(key)))
+        if i < len(self.shingle_hashes) and int(self.shingle_hashes[i]) == key:
+            return int(self.shingle_rows[i])
+        return None
+
+    def lookup(self, query: str, min_overlap: float = 0.5, min_hits: int = 2) -> Optional[Tuple[int, float]]:
+        """
+        Row of the line `query` quotes and a confidence: 1.0 for an exact (normalized)
+        line or sentence, otherwise the share of the query's shingles found in the
+        best line, if at least `min_overlap` and `min_hits` shingles (so a single
+        rare word triple never decides the movie).
+        """
+        words = normalize(query)
+        if len(words) < self.min_words:
+            return None
+        row = self._exact.get(hash_words(words))
+        if row is not None:
+            return row, 1.0
+
+        keys = {hash_words(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+        if not keys:
+            return None
+        votes = Counter(row for row in map(self._shingle_row, keys) if row is not None)
+        if not votes:
+            return None
+        row, hits = votes.most_common(1)[0]
+        overlap = hits / len(keys)
+        return (row, overlap) if overlap >= min_overlap and hits >= min_hits else None
+
+    def line(self, row: int) -> str:
+        return f"{self.speakers[row]}: {self.dialogues[row]}"
+
+    def match(self, query: str, context_lines: int = 2, min_overlap: float = 0.5) -> Optional[dict]:
+        """A vector-store style match for the quoted line, with its neighbouring lines as context."""
+        found = self.lookup(query, min_overlap)
+        if found is None:
+            return None
+        row, score = found
+        title_id = int(self.title_ids[row])
+        rows = [r for r in range(max(0, row - context_lines), min(self.count, row + context_lines + 1))
+                if int(self.title_ids[r]) == title_id]
+        movie_title = self.titles[title_id]
+        seq = int(self.seqs[row])
+        return {
+            # Namespaced apart from the vector store's "<title>_<chunk>" ids, which also key the first-turn cache
+            "id": f"quote:{movie_title}_{seq}",
+            "score": score,
+            "metadata": {
+                "text": "\n".join(self.line(r) for r in rows),
+                "movie_title": movie_title,
+                "speaker": self.speakers[row],
+                "dialogue": self.dialogues[row],
+                "seq": seq,
+            },
+        }
@@ -0,0 +1,89 @@
+import os
+import random
+import time
+from typing import Optional
+
+import redis
+
+import scripts.cache as cache
+from scripts.embedding_cache import query_hash
+
+FIRST_TURN_CACHE = os.getenv("FIRST_TURN_CACHE", "0") == "1"
+FIRST_TURN_CACHE_VARIANTS = int(os.getenv("FIRST_TURN_CACHE_VARIANTS", "3"))
+FIRST_TURN_CACHE_TTL = int(os.getenv("FIRST_TURN_CACHE_TTL", "86400"))
+FIRST_TURN_CACHE_SIZE = int(os.getenv("FIRST_TURN_CACHE_SIZE", "10000"))
+
+
+class FirstTurnCache:
+    """
+    Cache of character replies to the opening message of a chat.
+
+    Keyed on the retrieved movie, context chunk id and normalized user message, so
+    only identical opening exchanges share replies. Each key holds a pool of up to
+    `variants` generated replies; until the pool is full every request still
+    generates (and adds) a fresh reply, afterwards a random variant is served.
+    Keys expire after `ttl` seconds and the least recently filled keys beyond
+    `max_keys` are evicted. Entries are tagged with the global cache version, so
+    `/clear_cache` drops them too.
+    """
+
+    index_key = "first_turn_index"
+
+    def __init__(self, variants: int = 3, ttl: int = 86400, max_keys: int = 10000):
+        self.variants = variants
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._hits = 0
+        self._misses = 0
+        self._fills = 0
+
+    async def _key(self, movie_title: str, chunk_id: str, message: str) -> str:
+        return await cache.tagged_key("first_turn", query_hash(f"{movie_title}\n{chunk_id}\n{message}"))
+
+    async def get(self, movie_title: str, chunk_id: str, message: str) -> Optional[str]:
+        """A cached reply once the key's variant pool is full, else None."""
+        try:
+            key = await self._key(movie_title, chunk_id, message)
+            replies = await cache.client.lrange(key, 0, -1)
+        except redis.RedisError as e:
+            print(f"ERROR: First-turn cache lookup failed: {e}")
+            return None
+        if len(replies) < self.variants:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return random.choice(replies)
+
+    async def add(self, movie_title: str, chunk_id: str, message: str, reply: str) -> None:
+        if not reply:
+            return
+        try:
+            key = await self._key(movie_title, chunk_id, message)
+            async with cache.client.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, reply)
+                pipe.ltrim(key, -self.variants, -1)
+                pipe.expire(key, self.ttl)
+                pipe.zadd(self.index_key, {key: time.time()})
+                pipe.zcard(self.index_key)
+                size = (await pipe.execute())[-1]
+            if size > self.max_keys:
+                evicted = await cache.client.zpopmin(self.index_key, size - self.max_keys)
+                if evicted:
+                    await cache.client.unlink(*(evicted_key for evicted_key, _ in evicted))
+            self._fills += 1
+        except redis.RedisError as e:
+            print(f"ERROR: First-turn cache update failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "enabled": FIRST_TURN_CACHE,
+            "hits": self._hits,
+            "misses": self._misses,
+            "fills": self._fills,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+first_turn_cache = FirstTurnCache(variants=FIRST_TURN_CACHE_VARIANTS, ttl=FIRST_TURN_CACHE_TTL,
+                                  max_keys=FIRST_TURN_CACHE_SIZE)
@@ -1,40 +1,101 @@
-from sentence_transformers import SentenceTransformer
-from pinecone import Pinecone
-import requests
+from scripts.embedding_engine import engine
+from scripts.embedding_cache import EmbeddingCache
+from scripts.hf_client import CircuitBreaker, HFEmbeddingClient
+from scripts.lexical_index import BM25Index, reciprocal_rank_fusion
+from scripts.quote_index import QuoteIndex
+from scripts.vector_store import LocalStore, MappedStore, PineconeStore
+import scripts.cache as cache
+import asyncio
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-pc = Pinecone(os.getenv("PINECONE_API_KEY"))
-index = pc.Index(host="https://baai-n5yfgj0.svc.aped-4627-b74a.pinecone.io")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+if VECTOR_BACKEND == "local":
+    store = LocalStore.load(os.getenv("LOCAL_INDEX_PATH", "local_index.npz"),
+                            mode=os.getenv("LOCAL_INDEX_MODE", "flat"))
+elif VECTOR_BACKEND == "mapped":
+    store = MappedStore(os.getenv("EMBEDDING_ARTIFACT_PATH", "embeddings"))
+else:
+    store = PineconeStore(PINECONE_API_KEY)
+# Optional first-stage lexical index, built next to the embedding artifact by process_scripts_v2
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "lexical_index.npz")
+lexical_index = BM25Index.load(LEXICAL_INDEX_PATH) if os.path.exists(LEXICAL_INDEX_PATH) else None
+LEXICAL_CANDIDATES = int(os.getenv("LEXICAL_CANDIDATES", "10"))
+# A verbatim lexical hit only skips vector search for long, distinctive phrases
+LEXICAL_EXACT_MIN_TERMS = int(os.getenv("LEXICAL_EXACT_MIN_TERMS", "4"))
+LEXICAL_EXACT_MIN_IDF = float(os.getenv("LEXICAL_EXACT_MIN_IDF", "8.0"))
+# Optional exact-quote index over parsed dialogue lines, built by build_quote_index.py
+QUOTE_INDEX_PATH = os.getenv("QUOTE_INDEX_PATH", "quote_index.npz")
+quote_index = QuoteIndex.load(QUOTE_INDEX_PATH) if os.path.exists(QUOTE_INDEX_PATH) else None
 HF_API_KEY = os.getenv("HF_API_KEY")
-API_URL = "https://api-inference.huggingface.co/models/BAAI/bge-large-en-v1.5"
-headers = {"Authorization": f"Bearer {HF_API_KEY}"}
-
-def get_embedding(text):
-    payload = {"inputs": text}
-    response = requests.post(API_URL, headers=headers, json=payload)
-    return response.json()
-
-def get_context(query, top_k=1):
-
-    vector = get_embedding(query)
-    if type(vector) is not list:
-        model = SentenceTransformer('BAAI/bge-large-en-v1.5')
-        vector = model.encode(query, normalize_embeddings=True)
-
-    document=index.query(
-            namespace="movie_dialogues",
-            vector=vector.tolist() if type(vector) is not list else vector,
-            top_k=top_k,
-            include_metadata=True
-        )
-    return document
-
-# if __name__ == "__main__":
-#     query = "DAWSON kneels down by the bed, puts his hand on SANTIAGO'S"
-#     context = get_context(query)
-#     print(context)
+API_URL = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models/BAAI/bge-large-en-v1.5")
+HF_TIMEOUT = float(os.getenv("HF_TIMEOUT", "5"))
+# Calls that succeed but take longer than this still count against the breaker
+HF_SLOW_CALL_SECONDS = float(os.getenv("HF_SLOW_CALL_SECONDS", "1.5"))
 
+EMBEDDING_CACHE_REDIS = os.getenv("EMBEDDING_CACHE_REDIS", "0") == "1"
+embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    async_redis_client=cache.binary_client if EMBEDDING_CACHE_REDIS else None,
+)
+
+hf_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("HF_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("HF_BREAKER_RESET", "30")),
+    slow_call_seconds=HF_SLOW_CALL_SECONDS,
+)
+hf_client = HFEmbeddingClient(API_URL, HF_API_KEY, timeout=HF_TIMEOUT, breaker=hf_breaker)
+
+async def aembed_query(query):
+    """Embed a query through the cache, the pooled HF client (deadline and breaker), then the local engine."""
+    vector = await embedding_cache.aget(query)
+    if vector is not None:
+        return vector
+
+    vector = await hf_client.embed(query)
+    if vector is None:
+        vector = await asyncio.wrap_future(engine.submit(query))
+    return await embedding_cache.aput(query, vector)
+
+def query_index(vector, top_k=1):
+    return store.query(vector, top_k=top_k, namespace="movie_dialogues", include_metadata=True)
+
+def quote_query(query, top_k=1):
+    """
+    The quoted dialogue line with its surrounding lines, or None when `query` is not a
+    known quote. A quote resolves to a single match, so only `top_k == 1` searches use it.
+    """
+    if quote_index is None or top_k != 1:
+        return None
+    match = quote_index.match(query)
+    if match is None:
+        return None
+    return {"matches": [match], "namespace": "movie_dialogues"}
+
+def lexical_query(query, top_k=1):
+    """BM25 candidates for `query`, or None when no lexical index is loaded."""
+    if lexical_index is None:
+        return None
+    return lexical_index.search(query, max(top_k, LEXICAL_CANDIDATES))
+
+def exact_lexical_match(query, lexical_result, top_k=1):
+    """
+    The lexical result when its best chunk contains the query verbatim and the query
+    is long and rare enough to identify that chunk, else None.
+    """
+    if not lexical_result or not lexical_result["matches"]:
+        return None
+    if not lexical_index.contains_phrase(query, lexical_result["matches"][0], LEXICAL_EXACT_MIN_TERMS):
+        return None
+    if lexical_index.specificity(query) < LEXICAL_EXACT_MIN_IDF:
+        return None
+    return {"matches": lexical_result["matches"][:top_k], "namespace": lexical_result["namespace"]}
+
+def fuse_results(vector_result, lexical_result, top_k=1):
+    """Reciprocal rank fusion of the vector and lexical stages; vector wins ties."""
+    if not lexical_result or not lexical_result["matches"]:
+        return vector_result
+    return reciprocal_rank_fusion([vector_result, lexical_result], top_k)
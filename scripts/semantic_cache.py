@@ -0,0 +1,81 @@
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Near-duplicate query cache backed by a small in-process vector index.
+
+    Query embeddings of answered searches are kept in a fixed-size matrix (oldest
+    entry overwritten first). A new query whose cosine similarity to a stored one
+    reaches `threshold` reuses that stored search result, provided it was fetched
+    with at least the requested `top_k`.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 2048, dim: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.dim = dim
+
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._entries = [None] * max_entries
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector, top_k: int) -> Optional[dict]:
+        """Return a stored result for a query within `threshold`, trimmed to `top_k` matches."""
+        if not self.max_entries:
+            return None
+        vector = self._normalize(vector)
+        with self._lock:
+            if self._size:
+                scores = self._vectors[:self._size] @ vector
+                # Only entries fetched with enough matches can answer this query
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    _, entry_top_k, result = self._entries[i]
+                    if entry_top_k >= top_k:
+                        self._hits += 1
+                        return {**result, "matches": result.get("matches", [])[:top_k]}
+            self._misses += 1
+            return None
+
+    def add(self, query: str, vector, result: dict, top_k: int) -> None:
+        if not self.max_entries:
+            return
+        vector = self._normalize(vector)
+        with self._lock:
+            self._vectors[self._next] = vector
+            self._entries[self._next] = (query, top_k, result)
+            self._next = (self._next + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = [None] * self.max_entries
+            self._size = 0
+            self._next = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": self._size,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
@@ -1,10 +1,12 @@
 import os
 import json
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from tqdm import tqdm
-import concurrent.futures
 import time
+from ingest_manifest import IngestManifest, content_hash
+from mongo_search import ensure_indexes as ensure_search_indexes
 
 load_dotenv()
 
@@ -13,6 +15,23 @@ mongo_client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"
 db = mongo_client.movie_database
 dialogues_collection = db.dialogues
 
+def backfill_sequence_numbers(batch_size=1000):
+    """Sets the numeric `seq` field on dialogues stored before it existed."""
+    updated = 0
+    operations = []
+    for document in dialogues_collection.find({"seq": {"$exists": False}}, {"_id": 1}):
+        try:
+            seq = int(document["_id"].rsplit('_', 1)[1])
+        except (IndexError, ValueError):
+            continue
+        operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {"seq": seq}}))
+        if len(operations) >= batch_size:
+            updated += dialogues_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += dialogues_collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
 # Extract dialogues from JSON
 def extract_dialogues_from_json(json_data):
     movie_title = json_data.get("movie_title", "Unknown Movie")
@@ -38,90 +57,107 @@ def extract_dialogues_from_json(json_data):
 
     return movie_title, dialogues
 
-# Process a single dialogue
-def process_single_dialogue(args):
-    dialogue_id, movie_title, speaker, dialogue = args
-    
+def bulk_upsert_dialogues(operations):
+    """Runs one unordered bulk write and returns (inserted, updated, unchanged, errors)."""
     try:
-        # Check if the dialogue already exists in MongoDB
-        existing_document = dialogues_collection.find_one({"_id": dialogue_id})
-
-        if existing_document:
-            return f"Skipped existing: {movie_title}, Speaker: {speaker}"
-        else:
-            # Store new document in MongoDB
-            dialogues_collection.insert_one({
-                "_id": dialogue_id,
-                "title": movie_title,
-                "speaker": speaker,
-                "dialogue": dialogue,
-                "created_at": time.time()
-            })
-            
-            return f"Processed: {movie_title}, Speaker: {speaker}"
-    except Exception as e:
-        return f"Error processing {dialogue_id}: {str(e)}"
-
-def process_batch(batch):
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        batch_results = list(executor.map(process_single_dialogue, batch))
-        results.extend(batch_results)
-    return results
-
-def store_json_dialogues_in_mongodb(folder_path, batch_size=20):
+        result = dialogues_collection.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        for error in result.get("writeErrors", [])[:5]:
+            print(f"Error writing {error.get('op', {}).get('q', {}).get('_id')}: {error.get('errmsg')}")
+
+    matched, modified = result.get("nMatched", 0), result.get("nModified", 0)
+    return result.get("nUpserted", 0), modified, matched - modified, len(result.get("writeErrors", []))
+
+def store_json_dialogues_in_mongodb(folder_path, batch_size=1000, manifest_path="../manifests/store_mongodb.json"):
     # Create index for faster queries
     dialogues_collection.create_index("title")
     dialogues_collection.create_index("speaker")
+    # The (title, seq) and text indexes used by mongo_search
+    ensure_search_indexes()
     
     # Get all JSON files
     json_files = [f for f in os.listdir(folder_path) if f.endswith(".json")]
     print(f"Found {len(json_files)} JSON files")
-    
-    all_dialogue_tasks = []
-    
-    # First, extract all dialogues from all files
-    for filename in tqdm(json_files, desc="Preparing files"):
+
+    # Only scripts whose content changed since the last successful run are re-processed
+    manifest = IngestManifest(manifest_path)
+    updates = {}
+    stale_ids = []
+    unchanged_files = 0
+    for filename in manifest.removed_scripts(json_files):
+        stale_ids.extend(manifest.chunk_ids(filename))
+
+    inserted = updated = unchanged = errors = 0
+
+    # Dialogues are streamed from the parser into unordered bulk upserts, a few calls per script
+    for filename in tqdm(json_files, desc="Loading files"):
         file_path = os.path.join(folder_path, filename)
         with open(file_path, "r", encoding="utf-8") as file:
-            try:
-                json_data = json.load(file)
-                movie_title, dialogues = extract_dialogues_from_json(json_data)
-                
-                # Create tasks for each dialogue
-                for i, (speaker, dialogue) in enumerate(dialogues):
-                    dialogue_id = f"{movie_title}_{i}"
-                    all_dialogue_tasks.append((dialogue_id, movie_title, speaker, dialogue))
-            except json.JSONDecodeError:
-                print(f"Error: Could not parse JSON in {filename}")
-    
-    total_dialogues = len(all_dialogue_tasks)
-    print(f"Total dialogues to process: {total_dialogues}")
-    
-    # Process in batches
-    results = []
-    for i in tqdm(range(0, total_dialogues, batch_size), desc="Processing batches"):
-        batch = all_dialogue_tasks[i:i+batch_size]
-        batch_results = process_batch(batch)
-        results.extend(batch_results)
-        
-        # Add a small delay between batches
-        if i + batch_size < total_dialogues:
-            time.sleep(0.5)
-    
-    # Count processed vs skipped
-    processed = sum(1 for r in results if r.startswith("Processed"))
-    skipped = sum(1 for r in results if r.startswith("Skipped"))
-    errors = sum(1 for r in results if r.startswith("Error"))
-    
+            raw = file.read()
+        script_hash = content_hash(raw)
+        if manifest.script_unchanged(filename, script_hash):
+            unchanged_files += 1
+            continue
+        try:
+            json_data = json.loads(raw)
+        except json.JSONDecodeError:
+            print(f"Error: Could not parse JSON in {filename}")
+            continue
+
+        movie_title, dialogues = extract_dialogues_from_json(json_data)
+        dialogue_hashes = {f"{movie_title}_{i}": content_hash(f"{speaker}\n{dialogue}")
+                           for i, (speaker, dialogue) in enumerate(dialogues)}
+        changed, removed = manifest.diff_chunks(filename, dialogue_hashes)
+        changed = set(changed)
+        stale_ids.extend(removed)
+        updates[filename] = (script_hash, dialogue_hashes)
+
+        operations = [
+            UpdateOne(
+                {"_id": f"{movie_title}_{i}"},
+                {
+                    "$set": {"title": movie_title, "seq": i, "speaker": speaker, "dialogue": dialogue},
+                    "$setOnInsert": {"created_at": time.time()},
+                },
+                upsert=True,
+            )
+            for i, (speaker, dialogue) in enumerate(dialogues)
+            if f"{movie_title}_{i}" in changed
+        ]
+        for i in range(0, len(operations), batch_size):
+            counts = bulk_upsert_dialogues(operations[i:i + batch_size])
+            inserted += counts[0]
+            updated += counts[1]
+            unchanged += counts[2]
+            errors += counts[3]
+
+    print(f"{unchanged_files} unchanged files skipped, {len(stale_ids)} removed dialogues to delete")
+    if stale_ids:
+        dialogues_collection.delete_many({"_id": {"$in": stale_ids}})
+
+    # Dialogues from unchanged scripts may predate the seq field
+    backfilled = backfill_sequence_numbers(batch_size)
+    if backfilled:
+        print(f"Backfilled seq on {backfilled} dialogues")
+
     print(f"Processing complete:")
-    print(f"- {processed} new dialogues processed")
-    print(f"- {skipped} existing dialogues skipped")
+    print(f"- {inserted} new dialogues inserted")
+    print(f"- {updated} existing dialogues updated")
+    print(f"- {unchanged} existing dialogues unchanged")
     print(f"- {errors} errors encountered")
     
     if errors > 0:
         print("Some errors occurred during processing. Check logs for details.")
+        print("Manifest not updated; the affected files will be retried on the next run.")
+        return
+
+    for filename in manifest.removed_scripts(json_files):
+        manifest.forget(filename)
+    for filename, (script_hash, dialogue_hashes) in updates.items():
+        manifest.update(filename, script_hash, dialogue_hashes)
+    manifest.save()
 
 if __name__ == "__main__":
-    # Run the script with batch processing
-    store_json_dialogues_in_mongodb("../movie_scripts", batch_size=20)
\ No newline at end of file
+    # Run the script with bulk batches
+    store_json_dialogues_in_mongodb("../movie_scripts", batch_size=1000)
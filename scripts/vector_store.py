@@ -0,0 +1,481 @@
+import json
+import mmap
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from pinecone import Pinecone
+
+load_dotenv()
+
+PINECONE_HOST = os.getenv("PINECONE_HOST", "https://baai-n5yfgj0.svc.aped-4627-b74a.pinecone.io")
+DEFAULT_NAMESPACE = "movie_dialogues"
+
+
+def _encode_records(records: dict) -> np.ndarray:
+    """JSON records as UTF-8 bytes; a NumPy string array would store them as UTF-32."""
+    return np.frombuffer(json.dumps(records).encode("utf-8"), dtype=np.uint8)
+
+
+def _decode_records(array: np.ndarray) -> dict:
+    # Stores saved before records were UTF-8 encoded hold a unicode scalar
+    return json.loads(array.tobytes().decode("utf-8") if array.dtype == np.uint8 else str(array))
+
+
+class VectorStore(ABC):
+    """
+    Interface shared by the vector database backends.
+
+    Vectors are dicts of `{"id", "values", "metadata"}` (the Pinecone upsert
+    format) and `query` returns `{"matches": [{"id", "score", "metadata"}], "namespace"}`.
+    """
+
+    @abstractmethod
+    def query(self, vector, top_k: int = 1, namespace: str = DEFAULT_NAMESPACE,
+              include_metadata: bool = True, include_values: bool = False) -> dict:
+        ...
+
+    @abstractmethod
+    def upsert(self, vectors: List[Dict], namespace: str = DEFAULT_NAMESPACE) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str], namespace: str = DEFAULT_NAMESPACE) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self, namespace: str = DEFAULT_NAMESPACE) -> None:
+        """Delete every vector in `namespace`."""
+
+
+class PineconeStore(VectorStore):
+    """The hosted Pinecone index."""
+
+    def __init__(self, api_key: Optional[str] = None, host: str = PINECONE_HOST):
+        self.index = Pinecone(api_key or os.getenv("PINECONE_API_KEY")).Index(host=host)
+
+    def query(self, vector, top_k: int = 1, namespace: str = DEFAULT_NAMESPACE,
+              include_metadata: bool = True, include_values: bool = False) -> dict:
+        response = self.index.query(
+            namespace=namespace,
+            vector=vector.tolist() if type(vector) is not list else vector,
+            top_k=top_k,
+            include_metadata=include_metadata,
+            include_values=include_values,
+        )
+        return response.to_dict() if hasattr(response, "to_dict") else response
+
+    def upsert(self, vectors: List[Dict], namespace: str = DEFAULT_NAMESPACE) -> None:
+        self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def delete(self, ids: List[str], namespace: str = DEFAULT_NAMESPACE) -> None:
+        for i in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[i:i + 1000], namespace=namespace)
+
+    def clear(self, namespace: str = DEFAULT_NAMESPACE) -> None:
+        self.index.delete(delete_all=True, namespace=namespace)
+
+    def iter_vectors(self, namespace: str = DEFAULT_NAMESPACE, batch_size: int = 100) -> Iterable[Dict]:
+        """Yield every stored vector with its values and metadata."""
+        for id_page in self.index.list(namespace=namespace):
+            for i in range(0, len(id_page), batch_size):
+                fetched = self.index.fetch(ids=id_page[i:i + batch_size], namespace=namespace)
+                for vector_id, vector in fetched.vectors.items():
+                    yield {"id": vector_id, "values": vector.values, "metadata": vector.metadata or {}}
+
+
+class _Namespace:
+    def __init__(self, dim: int):
+        self.ids: List[str] = []
+        self.metadata: List[dict] = []
+        self.buffer = np.zeros((0, dim), dtype=np.float32)
+        self.rows: Dict[str, int] = {}
+        self.ann = None
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.buffer[:len(self.ids)]
+
+    def reserve(self, count: int) -> None:
+        """Grow the matrix geometrically so bulk loads do not copy it per batch."""
+        if count > len(self.buffer):
+            grown = np.zeros((max(count, 2 * len(self.buffer)), self.buffer.shape[1]), dtype=np.float32)
+            grown[:len(self.ids)] = self.vectors
+            self.buffer = grown
+
+
+class LocalStore(VectorStore):
+    """
+    In-process vector store for serving retrieval without a network hop.
+
+    `mode="flat"` does an exact inner-product search over a NumPy matrix;
+    `mode="hnsw"` searches an approximate hnswlib graph. The graph is built (or
+    loaded from the file `save` wrote next to the `.npz`) by `load` and
+    `from_artifact`, so no search pays for it; after writes it is rebuilt on the
+    next query. Vectors are L2-normalized on insert, so scores are cosine similarities like
+    the Pinecone index.
+    """
+
+    def __init__(self, dim: int = 1024, mode: str = "flat", ef: int = 64, m: int = 16):
+        if mode not in ("flat", "hnsw"):
+            raise ValueError(f"Unknown local index mode: {mode}")
+        self.dim = dim
+        self.mode = mode
+        self.ef = ef
+        self.m = m
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.Lock()
+
+    def _namespace(self, namespace: str) -> _Namespace:
+        if namespace not in self._namespaces:
+            self._namespaces[namespace] = _Namespace(self.dim)
+        return self._namespaces[namespace]
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def upsert(self, vectors: List[Dict], namespace: str = DEFAULT_NAMESPACE) -> None:
+        if not vectors:
+            return
+        values = self._normalize(np.asarray([v["values"] for v in vectors], dtype=np.float32))
+        with self._lock:
+            ns = self._namespace(namespace)
+            ns.reserve(len(ns.ids) + len(vectors))
+            for vector, row_values in zip(vectors, values):
+                row = ns.rows.get(vector["id"])
+                if row is None:
+                    row = len(ns.ids)
+                    ns.rows[vector["id"]] = row
+                    ns.ids.append(vector["id"])
+                    ns.metadata.append(vector.get("metadata", {}))
+                else:
+                    ns.metadata[row] = vector.get("metadata", {})
+                ns.buffer[row] = row_values
+            ns.ann = None
+
+    def delete(self, ids: List[str], namespace: str = DEFAULT_NAMESPACE) -> None:
+        with self._lock:
+            ns = self._namespace(namespace)
+            drop = {ns.rows[i] for i in ids if i in ns.rows}
+            if not drop:
+                return
+            keep = [row for row in range(len(ns.ids)) if row not in drop]
+            ns.buffer = ns.vectors[keep]
+            ns.ids = [ns.ids[row] for row in keep]
+            ns.metadata = [ns.metadata[row] for row in keep]
+            ns.rows = {vector_id: row for row, vector_id in enumerate(ns.ids)}
+            ns.ann = None
+
+    def clear(self, namespace: str = DEFAULT_NAMESPACE) -> None:
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+
+    def query(self, vector, top_k: int = 1, namespace: str = DEFAULT_NAMESPACE,
+              include_metadata: bool = True, include_values: bool = False) -> dict:
+        query = self._normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        ns = self._namespace(namespace)
+        top_k = min(top_k, len(ns.ids))
+        if top_k <= 0:
+            return {"matches": [], "namespace": namespace}
+
+        if self.mode == "hnsw":
+            labels, distances = self._ann(ns).knn_query(query, k=top_k)
+            rows, scores = labels[0], 1 - distances[0]
+        else:
+            scores = ns.vectors @ query
+            rows = np.argpartition(-scores, top_k - 1)[:top_k]
+            rows = rows[np.argsort(-scores[rows])]
+            scores = scores[rows]
+
+        matches = []
+        for row, score in zip(rows, scores):
+            match = {"id": ns.ids[row], "score": float(score)}
+            if include_metadata:
+                match["metadata"] = ns.metadata[row]
+            if include_values:
+                match["values"] = ns.vectors[row].tolist()
+            matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def count(self, namespace: str = DEFAULT_NAMESPACE) -> int:
+        return len(self._namespace(namespace).ids)
+
+    def _ann(self, ns: _Namespace, graph_path: Optional[str] = None):
+        if ns.ann is None:
+            with self._lock:
+                if ns.ann is None:
+                    import hnswlib  # Only needed for mode="hnsw"
+
+                    ann = hnswlib.Index(space="ip", dim=self.dim)
+                    loaded = False
+                    if graph_path and os.path.exists(graph_path):
+                        ann.load_index(graph_path, max_elements=max(len(ns.ids), 1))
+                        loaded = ann.get_current_count() == len(ns.ids)
+                        if not loaded:
+                            print(f"Ignoring stale HNSW graph {graph_path}, rebuilding")
+                            ann = hnswlib.Index(space="ip", dim=self.dim)
+                    if not loaded:
+                        ann.init_index(max_elements=max(len(ns.ids), 1), ef_construction=200, M=self.m)
+                        ann.add_items(ns.vectors, np.arange(len(ns.ids)))
+                    ann.set_ef(max(self.ef, 1))
+                    ns.ann = ann
+        return ns.ann
+
+    def build(self, path: Optional[str] = None) -> None:
+        """Build (or load from `save`'s graph files next to `path`) the HNSW graph of every namespace."""
+        if self.mode != "hnsw":
+            return
+        for name, ns in self._namespaces.items():
+            if ns.ids:
+                self._ann(ns, self._graph_path(path, name) if path else None)
+
+    @staticmethod
+    def _graph_path(path: str, namespace: str) -> str:
+        return f"{path}.{namespace}.hnsw"
+
+    def save(self, path: str) -> None:
+        """Write every namespace to a single `.npz` file, plus one HNSW graph file per namespace in hnsw mode."""
+        arrays = {}
+        for name, ns in self._namespaces.items():
+            arrays[f"{name}/vectors"] = ns.vectors
+            arrays[f"{name}/records"] = _encode_records({"ids": ns.ids, "metadata": ns.metadata})
+            if self.mode == "hnsw" and ns.ids:
+                self._ann(ns).save_index(self._graph_path(path, name))
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str, mode: str = "flat", **kwargs) -> "LocalStore":
+        """Load a store written by `save`."""
+        data = np.load(path)
+        store = None
+        for key in data.files:
+            name, kind = key.rsplit("/", 1)
+            if kind != "vectors":
+                continue
+            vectors = data[key].astype(np.float32)
+            if store is None:
+                store = cls(dim=vectors.shape[1], mode=mode, **kwargs)
+            records = _decode_records(data[f"{name}/records"])
+            ns = store._namespace(name)
+            ns.ids, ns.metadata, ns.buffer = records["ids"], records["metadata"], vectors
+            ns.rows = {vector_id: row for row, vector_id in enumerate(ns.ids)}
+        store = store or cls(mode=mode, **kwargs)
+        store.build(path)
+        return store
+
+    @classmethod
+    def from_artifact(cls, path: str, mode: str = "flat", namespace: str = DEFAULT_NAMESPACE,
+                      **kwargs) -> "LocalStore":
+        """Load an ingest artifact into memory, e.g. to build an HNSW graph over it."""
+        artifact = MappedStore(path, namespace)
+        store = cls(dim=artifact.dim, mode=mode, **kwargs)
+        ns = store._namespace(namespace)
+        ns.buffer = artifact.dequantize(0, artifact.count)
+        for row in range(artifact.count):
+            record = artifact.record(row)
+            ns.ids.append(record["id"])
+            ns.metadata.append(record["metadata"])
+        ns.rows = {vector_id: row for row, vector_id in enumerate(ns.ids)}
+        store.build()
+        return store
+
+    @classmethod
+    def from_store(cls, source: PineconeStore, namespace: str = DEFAULT_NAMESPACE,
+                   batch_size: int = 1000, **kwargs) -> "LocalStore":
+        """Copy a namespace out of the Pinecone index into a new local store."""
+        store = cls(**kwargs)
+        batch = []
+        for vector in source.iter_vectors(namespace):
+            batch.append(vector)
+            if len(batch) >= batch_size:
+                store.upsert(batch, namespace)
+                batch = []
+        store.upsert(batch, namespace)
+        return store
+
+
+class EmbeddingArtifactWriter:
+    """
+    Streams embeddings into a compact on-disk artifact for `MappedStore`.
+
+    The artifact is a directory holding `vectors.bin` (int8 or float16 rows),
+    `scales.bin` (float32 per-row scale, int8 only), `records.jsonl` (id and
+    metadata per row) with `offsets.bin` (uint64 byte offset of each record) and
+    `meta.json`. It is written to `<path>.partial` and moved into place on `close`.
+    """
+
+    def __init__(self, path: str, dim: int, dtype: str = "int8"):
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unsupported artifact dtype: {dtype}")
+        self.path = path
+        self.dim = dim
+        self.dtype = dtype
+        self.count = 0
+        self._partial = f"{path}.partial"
+        shutil.rmtree(self._partial, ignore_errors=True)
+        os.makedirs(self._partial)
+        self._vectors = open(os.path.join(self._partial, "vectors.bin"), "wb")
+        self._scales = open(os.path.join(self._partial, "scales.bin"), "wb") if dtype == "int8" else None
+        self._records = open(os.path.join(self._partial, "records.jsonl"), "wb")
+        self._offsets = open(os.path.join(self._partial, "offsets.bin"), "wb")
+
+    def append(self, ids: List[str], embeddings, metadata: List[dict]) -> None:
+        """Append a batch of rows; `embeddings` is any (n, dim) float array."""
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if self.dtype == "int8":
+            scales = np.abs(embeddings).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self._vectors.write(np.round(embeddings / scales[:, None]).astype(np.int8).tobytes())
+            self._scales.write(scales.astype(np.float32).tobytes())
+        else:
+            self._vectors.write(embeddings.astype(np.float16).tobytes())
+
+        offsets = []
+        for vector_id, record_metadata in zip(ids, metadata):
+            offsets.append(self._records.tell())
+            self._records.write(json.dumps({"id": vector_id, "metadata": record_metadata}).encode("utf-8") + b"\n")
+        self._offsets.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        self.count += len(ids)
+
+    def close(self) -> None:
+        self._offsets.write(np.asarray([self._records.tell()], dtype=np.uint64).tobytes())
+        for f in (self._vectors, self._scales, self._records, self._offsets):
+            if f is not None:
+                f.close()
+        with open(os.path.join(self._partial, "meta.json"), "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype, "count": self.count}, f)
+
+        previous = f"{self.path}.old"
+        if os.path.exists(self.path):
+            os.replace(self.path, previous)
+        os.replace(self._partial, self.path)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    def __enter__(self) -> "EmbeddingArtifactWriter":
+        return self
+
+    def copy_from(self, previous: "MappedStore", skip_ids: set, block_rows: int = 4096) -> int:
+        """Append every row of a previous artifact whose id is not in `skip_ids`."""
+        copied = 0
+        for start in range(0, previous.count, block_rows):
+            end = min(start + block_rows, previous.count)
+            records = [previous.record(row) for row in range(start, end)]
+            keep = [i for i, record in enumerate(records) if record["id"] not in skip_ids]
+            if keep:
+                self.append([records[i]["id"] for i in keep], previous.dequantize(start, end)[keep],
+                            [records[i]["metadata"] for i in keep])
+                copied += len(keep)
+        return copied
+
+    def abort(self) -> None:
+        """Discard the partial artifact, leaving any previous one in place."""
+        for f in (self._vectors, self._scales, self._records, self._offsets):
+            if f is not None:
+                f.close()
+        shutil.rmtree(self._partial, ignore_errors=True)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class MappedStore(VectorStore):
+    """
+    Read-only store over an artifact written by `EmbeddingArtifactWriter`.
+
+    Every file is memory-mapped, so opening is near-instant and worker processes
+    serving the same artifact share one copy of its pages. Search is an exact
+    scan in blocks of `block_rows`, dequantizing one block at a time.
+    """
+
+    def __init__(self, path: str, namespace: str = DEFAULT_NAMESPACE, block_rows: int = 65536):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.path = path
+        self.namespace = namespace
+        self.block_rows = block_rows
+        self.dim = meta["dim"]
+        self.dtype = meta["dtype"]
+        self.count = meta["count"]
+
+        self.scales = None
+        self.offsets = np.memmap(os.path.join(path, "offsets.bin"), dtype=np.uint64, mode="r", shape=(self.count + 1,))
+        if not self.count:
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+            self._records = b""
+            return
+
+        self.vectors = np.memmap(os.path.join(path, "vectors.bin"), dtype=self.dtype, mode="r",
+                                 shape=(self.count, self.dim))
+        if self.dtype == "int8":
+            self.scales = np.memmap(os.path.join(path, "scales.bin"), dtype=np.float32, mode="r", shape=(self.count,))
+        with open(os.path.join(path, "records.jsonl"), "rb") as f:
+            self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def record(self, row: int) -> dict:
+        """Read the id and metadata of `row` from the sidecar."""
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self._records[start:end])
+
+    def dequantize(self, start: int, end: int) -> np.ndarray:
+        block = np.asarray(self.vectors[start:end], dtype=np.float32)
+        if self.scales is not None:
+            block *= np.asarray(self.scales[start:end])[:, None]
+        return block
+
+    def query(self, vector, top_k: int = 1, namespace: str = DEFAULT_NAMESPACE,
+              include_metadata: bool = True, include_values: bool = False) -> dict:
+        top_k = min(top_k, self.count)
+        if namespace != self.namespace or top_k <= 0:
+            return {"matches": [], "namespace": namespace}
+        query = np.asarray(vector, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) or 1)
+
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, self.count, self.block_rows):
+            end = min(start + self.block_rows, self.count)
+            scores = self.dequantize(start, end) @ query
+            k = min(top_k, len(scores))
+            rows = np.argpartition(-scores, k - 1)[:k]
+            best_rows = np.concatenate([best_rows, rows + start])
+            best_scores = np.concatenate([best_scores, scores[rows]])
+            keep = np.argsort(-best_scores)[:top_k]
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        matches = []
+        for row, score in zip(best_rows, best_scores):
+            record = self.record(int(row))
+            match = {"id": record["id"], "score": float(score)}
+            if include_metadata:
+                match["metadata"] = record["metadata"]
+            if include_values:
+                match["values"] = self.dequantize(int(row), int(row) + 1)[0].tolist()
+            matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def upsert(self, vectors: List[Dict], namespace: str = DEFAULT_NAMESPACE) -> None:
+        raise NotImplementedError("MappedStore is read-only; re-run the ingest to rebuild the artifact")
+
+    def delete(self, ids: List[str], namespace: str = DEFAULT_NAMESPACE) -> None:
+        raise NotImplementedError("MappedStore is read-only; re-run the ingest to rebuild the artifact")
+
+    def clear(self, namespace: str = DEFAULT_NAMESPACE) -> None:
+        raise NotImplementedError("MappedStore is read-only; re-run the ingest to rebuild the artifact")
+
+
+if __name__ == "__main__":
+    # Export the hosted movie_dialogues vectors so they can be served with VECTOR_BACKEND=local
+    output_path = os.getenv("LOCAL_INDEX_PATH", "local_index.npz")
+    local_store = LocalStore.from_store(PineconeStore(), mode=os.getenv("LOCAL_INDEX_MODE", "flat"))
+    local_store.save(output_path)
+    print(f"Saved {local_store.count()} vectors to {output_path}")